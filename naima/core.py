@@ -2,14 +2,22 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
+import os
+import glob
+import time
+import numbers
 import numpy as np
 from astropy import log
 import astropy
 import astropy.units as u
+from astropy.extern import six
+from astropy.extern.six.moves import cPickle
 
 from .utils import validate_data_table, sed_conversion
 
-__all__ = ["normal_prior", "uniform_prior", "get_sampler", "run_sampler"]
+__all__ = ["normal_prior", "uniform_prior", "Prior", "get_sampler", "run_sampler",
+           "print_progress", "step_stats_table", "SocketPool", "run_worker",
+           "run_batch"]
 
 # Define phsyical types used in plot and utils.validate_data_table
 u.def_physical_type(u.erg / u.cm ** 2 / u.s, 'flux')
@@ -23,7 +31,14 @@ u.def_physical_type(u.Unit('1/cm3'), 'number density')
 
 def uniform_prior(value, umin, umax):
     """Uniform prior distribution.
+
+    ``value`` can also be an array, e.g., the values of a parameter for all
+    walkers, in which case an array is returned.
     """
+    if np.ndim(value) > 0:
+        value = np.asarray(value)
+        return np.where((umin <= value) & (value <= umax), 0.0, - np.inf)
+
     if umin <= value <= umax:
         return 0.0
     else:
@@ -33,108 +48,1367 @@ def uniform_prior(value, umin, umax):
 def normal_prior(value, mean, sigma):
     """Normal prior distribution.
     """
-    return - 0.5 * (2 * np.pi * sigma) - (value - mean) ** 2 / (2. * sigma)
+    return (- 0.5 * np.log(2 * np.pi * sigma ** 2)
+            - (value - mean) ** 2 / (2. * sigma ** 2))
+
+
+class Prior(object):
+    """Prior distribution built from independent terms for each parameter.
+
+    Uniform and normal terms are added with the `uniform` and `normal`
+    methods, and the prior is evaluated for a single parameter vector or for
+    all walkers at once with a single vectorized call. A `Prior` instance can
+    be passed as the ``prior`` argument of `get_sampler` and `run_sampler`,
+    also with ``vectorize=True``. Walkers outside the bounds of the uniform
+    terms have a log-probability of ``-np.inf``, and are rejected before the
+    model is evaluated.
+
+    Parameters
+    ----------
+    labels : list of str, optional
+        Parameter labels, which allow referring to parameters by label
+        instead of by index.
+
+    Examples
+    --------
+    A positive normalization, an index with a normal prior, and a cutoff
+    energy between 1 and 100 TeV::
+
+        prior = Prior(['norm', 'index', 'cutoff'])
+        prior.uniform('norm', 0, np.inf)
+        prior.normal('index', 2.0, 0.5)
+        prior.uniform('cutoff', 1, 100)
+    """
+
+    def __init__(self, labels=None):
+        self.labels = labels
+        self._uniform = []
+        self._normal = []
+
+    def _index(self, par):
+        if isinstance(par, six.string_types):
+            if self.labels is None or par not in self.labels:
+                raise ValueError('Parameter label {0} not found'.format(par))
+            return list(self.labels).index(par)
+        return int(par)
+
+    def uniform(self, par, umin=-np.inf, umax=np.inf):
+        """Add a uniform prior between ``umin`` and ``umax`` for parameter
+        ``par`` (index or label).
+        """
+        self._uniform.append((self._index(par), umin, umax))
+        return self
+
+    def normal(self, par, mean, sigma):
+        """Add a normal prior with ``mean`` and ``sigma`` for parameter
+        ``par`` (index or label).
+        """
+        if sigma <= 0:
+            raise ValueError('sigma must be positive')
+        self._normal.append((self._index(par), mean, sigma))
+        return self
+
+    def __call__(self, pars):
+        """Log-probability of the prior for parameter vector ``pars``, or for
+        an array of parameter vectors with shape ``(nwalkers, ndim)``.
+        """
+        pars = np.asarray(pars, dtype=float)
+        single = pars.ndim == 1
+        pars = np.atleast_2d(pars)
+
+        lnprob = np.zeros(len(pars))
+
+        if len(self._uniform) > 0:
+            idx, umin, umax = [np.array(x) for x in zip(*self._uniform)]
+            values = pars[:, idx]
+            inside = np.all((umin <= values) & (values <= umax), axis=1)
+            lnprob[~inside] = - np.inf
+
+        if len(self._normal) > 0:
+            idx, mean, sigma = [np.array(x) for x in zip(*self._normal)]
+            lnprob += np.sum(normal_prior(pars[:, idx], mean, sigma), axis=1)
+
+        if single:
+            return lnprob[0]
+        return lnprob
 
 # Probability function
 
 
+class _LikelihoodData(object):
+    """Unit-free layout of a data dictionary for likelihood evaluations.
+
+    The validated data is compiled once into contiguous arrays in the flux
+    unit of the data: the fluxes of the detections, the halved inverse
+    variances for the model below (``lo``) and above (``hi``) the data, the
+    indices and fluxes of the upper limits, and the constant ``log(1-cl)``
+    added for each violated upper limit. Calling the instance with a model
+    returns its log-likelihood.
+
+    Parameters
+    ----------
+    data : dict
+        Data dictionary, as returned by `~naima.utils.validate_data_table`.
+    """
+
+    def __init__(self, data):
+        flux = data['flux']
+        self.unit = flux.unit
+        flux = flux.value
+        dflux = np.array(data['dflux'].to(self.unit).value, dtype=float)
+        if dflux.ndim == 1:
+            dflux = np.vstack((dflux, dflux))
+
+        ul = np.asarray(data['ul'], dtype=bool)
+        self.nul = int(np.sum(ul))
+        if self.nul > 0:
+            self.det = np.ascontiguousarray(np.where(~ul)[0])
+        else:
+            # basic slicing avoids copying the model array
+            self.det = slice(None)
+        self.ul = np.ascontiguousarray(np.where(ul)[0])
+
+        self.flux = np.ascontiguousarray(flux[self.det], dtype=float)
+        self.half_ivar_lo = np.ascontiguousarray(0.5 / dflux[0][self.det] ** 2)
+        self.half_ivar_hi = np.ascontiguousarray(0.5 / dflux[1][self.det] ** 2)
+        self.ul_flux = np.ascontiguousarray(flux[self.ul], dtype=float)
+        self.lncl = np.log(1. - data.get('cl', 0.9))
+
+    def _values(self, model):
+        if isinstance(model, u.Quantity):
+            if model.unit == self.unit:
+                return model.value
+            return model.to(self.unit).value
+        return u.Quantity(model).to(self.unit).value
+
+    def __call__(self, model):
+        """Log-likelihood of a model flux array of shape ``(..., ndata)``.
+        """
+        model = self._values(model)
+
+        difference = model[..., self.det] - self.flux
+        # use different errors for model above or below data
+        half_ivar = np.where(difference > 0, self.half_ivar_hi,
+                             self.half_ivar_lo)
+        logprob = - np.sum(difference * difference * half_ivar, axis=-1)
+
+        if self.nul > 0:
+            # deal with upper limits at CL set by data['cl']
+            violated_uls = np.sum(model[..., self.ul] > self.ul_flux, axis=-1)
+            logprob = logprob + violated_uls * self.lncl
+
+        return logprob
+
+
 def lnprobmodel(model, data):
 
-    ul = data['ul']
-    notul = -ul
+    return _LikelihoodData(data)(model)
+
+
+def _split_modelout(modelout):
+    """Split the output of a model function into the model and the blobs.
+
+    The model is saved as first blob unless it is already among the blobs
+    returned by the model function.
+    """
+    if ((type(modelout) == tuple or type(modelout) == list)
+            and (type(modelout) != np.ndarray)):
+        model = modelout[0]
 
-    difference = model[notul] - data['flux'][notul]
+        for blob in modelout[1:]:
+            if blob is model or (isinstance(blob, np.ndarray)
+                                 and blob.shape == np.shape(model)
+                                 and np.all(blob == model)):
+                return model, modelout[1:]
 
-    if data['dflux'].ndim > 1:
-# use different errors for model above or below data
-        sign = difference > 0
-        loerr, hierr = 1 * -sign, 1 * sign
-        logprob = - difference ** 2 / (2. * (loerr * data['dflux'][0][notul] +
-                                             hierr * data['dflux'][1][notul]) ** 2)
+        return model, modelout
     else:
-        logprob = - difference ** 2 / (2. * data['dflux'][notul] ** 2)
+        return modelout, (modelout, )
 
-    totallogprob = np.sum(logprob)
 
-    if np.sum(ul) > 0:
-        # deal with upper limits at CL set by data['cl']
-        violated_uls = np.sum(model[ul] > data['flux'][ul])
-        totallogprob += violated_uls * np.log(1. - data['cl'])
+class _EvalStats(object):
+    """Cumulative number of log-probability evaluations and time spent in the
+    prior, model, and likelihood functions.
+    """
+
+    def __init__(self):
+        self.nevals = 0
+        self.time = {'prior': 0., 'model': 0., 'likelihood': 0.}
 
-    return totallogprob
+    def add(self, nevals, t_prior, t_model, t_likelihood):
+        self.nevals += nevals
+        self.time['prior'] += t_prior
+        self.time['model'] += t_model
+        self.time['likelihood'] += t_likelihood
 
 
-def lnprob(pars, data, modelfunc, priorfunc):
+def lnprob(pars, data, modelfunc, priorfunc, stats=None, likelihood=None):
 
+    t0 = time.time()
     if priorfunc is None:
         lnprob_priors = 0.0
     else:
         lnprob_priors = priorfunc(pars)
+    t1 = t2 = time.time()
 
 # If prior is -np.inf, avoid calling the function as invalid calls may be made,
 # and the result will be discarded anyway
     if not np.isinf(lnprob_priors):
-        modelout = modelfunc(pars, data)
-
         # Save blobs or save model if no blobs given
         # If model is not in blobs, save model+blobs
-        if ((type(modelout) == tuple or type(modelout) == list)
-                and (type(modelout) != np.ndarray)):
-            model = modelout[0]
+        model, blob = _split_modelout(modelfunc(pars, data))
+        t2 = time.time()
 
-            MODEL_IN_BLOB = False
-            for blob in modelout[1:]:
-                if np.all(blob == model):
-                    MODEL_IN_BLOB=True
-
-            if MODEL_IN_BLOB:
-                blob = modelout[1:]
-            else:
-                blob = modelout
+        if likelihood is None:
+            lnprob_model = lnprobmodel(model, data)
         else:
-            model = modelout
-            blob = (modelout, )
-
-        lnprob_model = lnprobmodel(model, data)
+            lnprob_model = likelihood(model)
     else:
         lnprob_model = 0.0
         blob = None
 
     total_lnprob = lnprob_model + lnprob_priors
 
+    if stats is not None:
+        stats.add(1, t1 - t0, t2 - t1, time.time() - t2)
+
     return total_lnprob, blob
 
+# Vectorized probability functions
+
+
+def lnprobmodel_vectorized(model, data):
+    """Log-likelihood of an ensemble of models.
+
+    Parameters
+    ----------
+    model : :class:`~astropy.units.Quantity` array
+        Model fluxes with shape ``(nwalkers, ndata)``.
+    data : dict
+        Data dictionary, as returned by `~naima.utils.validate_data_table`.
+
+    Returns
+    -------
+    logprob : array
+        Log-likelihood of each model, with shape ``(nwalkers,)``.
+    """
+    return _LikelihoodData(data)(model)
+
+
+def lnprob_vectorized(pars, data, modelfunc, priorfunc, stats=None,
+                      likelihood=None):
+    """Log-probability of an ensemble of walkers.
+
+    The model and prior functions are called once for all walkers, with a
+    ``(nwalkers, ndim)`` array of parameter vectors. Walkers for which the
+    prior is ``-np.inf`` are not passed to the model function.
+
+    Returns
+    -------
+    lnprob : array
+        Log-probability of each walker.
+    blobs : list
+        Blobs of each walker, or `None` for walkers outside of the prior
+        bounds.
+    """
+    pars = np.atleast_2d(pars)
+    nwalkers = pars.shape[0]
+
+    t0 = time.time()
+    if priorfunc is None:
+        lnprob_priors = np.zeros(nwalkers)
+    else:
+        lnprob_priors = np.zeros(nwalkers) + priorfunc(pars)
+    t1 = t2 = time.time()
+
+    total_lnprob = lnprob_priors.copy()
+    blobs = [None, ] * nwalkers
+
+    valid = np.where(~np.isinf(lnprob_priors))[0]
+
+    if len(valid) > 0:
+        model, modelblobs = _split_modelout(modelfunc(pars[valid], data))
+        t2 = time.time()
+
+        if likelihood is None:
+            total_lnprob[valid] += lnprobmodel_vectorized(model, data)
+        else:
+            total_lnprob[valid] += likelihood(model)
+
+        for i, idx in enumerate(valid):
+            blobs[idx] = tuple(blob[i] for blob in modelblobs)
+
+    if stats is not None:
+        stats.add(nwalkers, t1 - t0, t2 - t1, time.time() - t2)
+
+    return total_lnprob, blobs
+
+
+class _VectorizedPool(object):
+    """Pool-like object for emcee that evaluates the log-probability of all
+    walkers in a single call to a vectorized log-probability function.
+    """
+
+    def map(self, func, positions):
+        lnprobs, blobs = func(np.array(positions))
+        return list(zip(lnprobs, blobs))
+
+# Worker pool
+
+# Data, model and prior of the sampler in worker processes of a _WorkerPool
+_worker_state = {}
+
+
+def _init_worker(data, model, prior):
+    _worker_state['args'] = (data, model, prior)
+    _worker_state['likelihood'] = _LikelihoodData(data)
+
+
+def _worker_lnprob(pars):
+    stats = _EvalStats()
+    out = lnprob(pars, *_worker_state['args'], stats=stats,
+                 likelihood=_worker_state['likelihood'])
+    return out, (stats.nevals, stats.time)
+
+
+class _WorkerPool(object):
+    """Pool of worker processes for emcee that receive the data, model and
+    prior once at start-up.
+
+    The tasks sent to the workers only carry the parameter vectors, and each
+    worker gets a single chunk of walkers per map call. On platforms that
+    fork new processes, the workers inherit the memory of the parent process,
+    including any kernel caches warmed up before the pool was created. The
+    number of evaluations and the time spent in the prior, model and
+    likelihood functions by the workers are added to ``stats``.
+    """
+
+    def __init__(self, processes, data, model, prior, stats=None):
+        from emcee.interruptible_pool import InterruptiblePool
+
+        self.processes = processes
+        self.stats = stats
+        self._pool = InterruptiblePool(processes, initializer=_init_worker,
+                                       initargs=(data, model, prior))
+
+    def map(self, func, positions):
+        # func is the emcee wrapper of lnprob with its arguments, which
+        # already live in the workers
+        positions = list(positions)
+        chunksize = int(np.ceil(len(positions) / float(self.processes)))
+        results = self._pool.map(_worker_lnprob, positions, chunksize)
+
+        if self.stats is not None:
+            for out, (nevals, times) in results:
+                self.stats.add(nevals, times['prior'], times['model'],
+                               times['likelihood'])
+
+        return [out for out, _ in results]
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+
+class SocketPool(object):
+    """Pool of remote worker processes connected through TCP sockets.
+
+    The pool listens on ``address`` for ``nworkers`` workers started with
+    `run_worker`, possibly on other machines. When the pool is passed to
+    `get_sampler` or `run_sampler`, it waits for the workers to connect and
+    sends them the data, model and prior of the sampler. Then, at each
+    ensemble update the walker positions are split in one chunk per worker,
+    and only the positions and the resulting log-probabilities and blobs are
+    sent over the network.
+
+    Messages are pickled and authenticated with ``authkey``, which must be
+    the same for the pool and the workers. As unpickling can execute
+    arbitrary code, the pool should only be exposed to trusted networks.
+
+    Parameters
+    ----------
+    address : tuple, optional
+        ``(host, port)`` on which to listen for workers. If the port is 0, a
+        free port is chosen, and can be read from the ``address`` attribute.
+        Default is ``('', 0)``, i.e., all interfaces on a free port.
+    nworkers : int, optional
+        Number of workers to wait for. Default is 1.
+    authkey : bytes
+        Authentication key.
+
+    Examples
+    --------
+    Start the sampler with a pool listening on port 6300 and waiting for two
+    workers::
+
+        pool = naima.SocketPool(('', 6300), nworkers=2, authkey=b'secret')
+        sampler, pos = naima.run_sampler(pool=pool, **kwargs)
+
+    and start each worker on the remote machines with::
+
+        python -c "import naima; naima.run_worker(('coordinator', 6300), b'secret')"
+
+    Note that the model and prior functions must be importable in the workers.
+    """
+
+    def __init__(self, address=('', 0), nworkers=1, authkey=None):
+        from multiprocessing.connection import Listener
+
+        if authkey is None:
+            raise TypeError('An authentication key must be provided')
+
+        self.nworkers = nworkers
+        self.stats = None
+        self._listener = Listener(tuple(address), authkey=authkey)
+        self.address = self._listener.address
+        self._connections = []
+
+    def start(self, data, model, prior, stats=None):
+        """Wait for the workers to connect and send them the data, model and
+        prior.
+        """
+        self.stats = stats
+        while len(self._connections) < self.nworkers:
+            conn = self._listener.accept()
+            log.info('Worker {0} of {1} connected from {2}'.format(
+                len(self._connections) + 1, self.nworkers,
+                self._listener.last_accepted))
+            self._connections.append(conn)
+
+        for conn in self._connections:
+            conn.send(('init', (data, model, prior)))
+
+    def map(self, func, positions):
+        positions = list(positions)
+        chunksize = int(np.ceil(len(positions) / float(self.nworkers)))
+        chunks = [positions[i:i + chunksize]
+                  for i in range(0, len(positions), chunksize)]
+
+        for conn, chunk in zip(self._connections, chunks):
+            conn.send(('eval', chunk))
+
+        results = []
+        for conn, chunk in zip(self._connections, chunks):
+            status, out = conn.recv()
+            if status != 'result':
+                raise RuntimeError('Remote worker failed:\n' + out)
+            results += out
+
+        if self.stats is not None:
+            for out, (nevals, times) in results:
+                self.stats.add(nevals, times['prior'], times['model'],
+                               times['likelihood'])
+
+        return [out for out, _ in results]
+
+    def close(self):
+        """Stop the workers and close the connections.
+        """
+        for conn in self._connections:
+            try:
+                conn.send(('stop', None))
+                conn.close()
+            except (IOError, EOFError):
+                pass
+        self._connections = []
+        self._listener.close()
+
+
+def run_worker(address, authkey, timeout=60):
+    """Evaluate log-probabilities for a `SocketPool` until it is closed.
+
+    Parameters
+    ----------
+    address : tuple
+        ``(host, port)`` of the `SocketPool`.
+    authkey : bytes
+        Authentication key of the `SocketPool`.
+    timeout : float, optional
+        Time in seconds during which to retry connecting to the pool, e.g.,
+        if the worker was started before the pool. Default is 60.
+    """
+    import traceback
+    from multiprocessing.connection import Client
+
+    start = time.time()
+    while True:
+        try:
+            conn = Client(tuple(address), authkey=authkey)
+            break
+        except (IOError, OSError):
+            if time.time() - start > timeout:
+                raise
+            time.sleep(0.1)
+
+    try:
+        while True:
+            try:
+                command, args = conn.recv()
+            except EOFError:
+                break
+
+            if command == 'init':
+                _init_worker(*args)
+            elif command == 'eval':
+                try:
+                    conn.send(('result', [_worker_lnprob(pars)
+                                          for pars in args]))
+                except Exception:
+                    conn.send(('error', traceback.format_exc()))
+            elif command == 'stop':
+                break
+    finally:
+        conn.close()
+
+# Chain checkpoints
+
+
+class _ChainCheckpoint(object):
+    """On-disk storage of the walker chain, written in chunks of steps.
+
+    Each chunk is stored in the ``path`` directory as an ``npz`` file with the
+    walker positions (``chain``, with shape ``(nwalkers, nsteps, ndim)``) and
+    log-probabilities (``lnprobability``), and a pickle file with the blobs
+    and the sampler state (random state and acceptance counts) after the last
+    step of the chunk. The ``npz`` file is written last and atomically, so
+    that only complete chunks are read on resume.
+    """
+
+    def __init__(self, path, chunk_size=10):
+        self.path = path
+        self.chunk_size = max(int(chunk_size), 1)
+        self._reset_buffer()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _reset_buffer(self):
+        self._pos = []
+        self._lnprob = []
+        self._blobs = []
+        self._state = None
+
+    def _chunk_files(self):
+        return sorted(glob.glob(os.path.join(self.path, 'chunk_*.npz')))
+
+    def append(self, sampler, pos, lnprob, rstate, blobs=None):
+        """Add a step to the buffer, and write it to disk if it is full.
+        """
+        # emcee updates these arrays in place, store copies
+        self._pos.append(np.array(pos))
+        self._lnprob.append(np.array(lnprob))
+        self._blobs.append(None if blobs is None else list(blobs))
+        self._state = {'rstate': rstate,
+                       'naccepted': np.array(sampler.naccepted),
+                       'iterations': sampler.iterations}
+
+        if len(self._pos) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered steps to a new chunk.
+        """
+        if len(self._pos) == 0:
+            return
+
+        fname = os.path.join(self.path,
+                             'chunk_{0:06d}'.format(len(self._chunk_files())))
+
+        with open(fname + '.pickle', 'wb') as f:
+            cPickle.dump({'blobs': self._blobs, 'state': self._state}, f,
+                         protocol=cPickle.HIGHEST_PROTOCOL)
+
+        # np.savez appends the .npz extension to file names without it
+        with open(fname + '.tmp', 'wb') as f:
+            np.savez(f, chain=np.swapaxes(np.array(self._pos), 0, 1),
+                     lnprobability=np.array(self._lnprob).T)
+        os.rename(fname + '.tmp', fname + '.npz')
+
+        self._reset_buffer()
+
+    def load(self, nsteps=None):
+        """Read the chunks written to disk.
+
+        Parameters
+        ----------
+        nsteps : int, optional
+            If given, only the chunks containing the last ``nsteps`` stored
+            steps are read, and only those steps are returned.
+
+        Returns
+        -------
+        checkpoint : dict or `None`
+            Dictionary with the ``chain``, ``lnprobability``, and ``blobs``
+            of the stored steps, and the ``rstate``, ``naccepted`` and
+            ``iterations`` of the sampler at the last stored step. `None` if
+            no chunks are found.
+        """
+        chunks = self._chunk_files()
+        if len(chunks) == 0:
+            return None
+
+        chain, lnprobability, blobs = [], [], []
+        state = None
+        for chunk in reversed(chunks):
+            with open(chunk.replace('.npz', '.pickle'), 'rb') as f:
+                extra = cPickle.load(f)
+            if state is None:
+                state = extra['state']
+            arrays = np.load(chunk)
+            chain.insert(0, arrays['chain'])
+            lnprobability.insert(0, arrays['lnprobability'])
+            blobs = extra['blobs'] + blobs
+            if nsteps is not None and len(blobs) >= nsteps:
+                break
+
+        checkpoint = state
+        checkpoint['chain'] = np.concatenate(chain, axis=1)
+        checkpoint['lnprobability'] = np.concatenate(lnprobability, axis=1)
+        checkpoint['blobs'] = blobs
+        if nsteps is not None:
+            checkpoint['chain'] = checkpoint['chain'][:, -nsteps:]
+            checkpoint['lnprobability'] = checkpoint['lnprobability'][:, -nsteps:]
+            checkpoint['blobs'] = blobs[-nsteps:]
+
+        return checkpoint
+
+    @staticmethod
+    def restore(sampler, checkpoint):
+        """Restore the chain and state of ``sampler`` from ``checkpoint``.
+        """
+        if checkpoint['chain'].shape[::2] != (sampler.k, sampler.dim):
+            raise ValueError('The number of walkers or parameters of the '
+                             'sampler does not match those of the checkpoint')
+
+        sampler.reset()
+        sampler._chain = checkpoint['chain']
+        sampler._lnprob = checkpoint['lnprobability']
+        if checkpoint['blobs'][-1] is not None:
+            sampler._blobs = list(checkpoint['blobs'])
+        # thinned or truncated chains are shorter than the number of steps
+        sampler.iterations = checkpoint.get('iterations',
+                                            sampler._chain.shape[1])
+        sampler.naccepted = checkpoint['naccepted']
+        sampler.random_state = checkpoint['rstate']
+
+# Blob storage
+
+
+class _BlobField(object):
+    """Storage for the values of one blob index for all steps and walkers.
+
+    Blobs following the naima conventions are stored in a single array with
+    shape ``(nsteps, nwalkers, ...)`` together with their unit:
+
+    - ``'array'``: a Quantity array, e.g., the model at the data energies.
+    - ``'pair'``: an ``(energy, flux)`` pair of Quantities, where the energy
+      array is the same for all blobs and is stored only once.
+    - ``'scalar'``: a scalar or Quantity scalar.
+
+    Any other blob format is kept as a list of lists (``'object'``).
+    """
+
+    def __init__(self, blob, nwalkers, capacity):
+        if (isinstance(blob, (tuple, list)) and len(blob) == 2
+                and isinstance(blob[0], u.Quantity)
+                and isinstance(blob[1], u.Quantity)
+                and blob[0].shape == blob[1].shape):
+            self.kind = 'pair'
+            self._x = blob[0]
+            self.x = blob[0].copy()
+            value = blob[1]
+        elif isinstance(blob, (u.Quantity, numbers.Number)):
+            value = blob
+            if np.ndim(blob) == 0:
+                self.kind = 'scalar'
+            else:
+                self.kind = 'array'
+        else:
+            self.kind = 'object'
+            self.values = []
+            return
+
+        self.unit = getattr(value, 'unit', None)
+        self.values = np.zeros((capacity, nwalkers) + np.shape(value))
+
+    def _value(self, blob):
+        """Unitless value of ``blob``, or `None` if it does not follow the
+        format of this field.
+        """
+        if self.kind == 'pair':
+            if not (isinstance(blob, (tuple, list)) and len(blob) == 2
+                    and (blob[0] is self._x or
+                         (isinstance(blob[0], u.Quantity)
+                          and blob[0].unit == self.x.unit
+                          and np.array_equal(blob[0].value, self.x.value)))):
+                return None
+            blob = blob[1]
+
+        if self.unit is None:
+            if (isinstance(blob, u.Quantity)
+                    or not isinstance(blob, numbers.Number)):
+                return None
+            return blob
+
+        if not isinstance(blob, u.Quantity) or blob.shape != self.values.shape[2:]:
+            return None
+        if blob.unit is self.unit:
+            return blob.value
+        try:
+            return blob.to(self.unit).value
+        except u.UnitsError:
+            return None
+
+    def _blob(self, value):
+        if self.unit is None:
+            return value
+        value = u.Quantity(value, self.unit)
+        if self.kind == 'pair':
+            return (self.x.copy(), value)
+        return value
+
+    def set(self, nsteps, step, missing):
+        """Store ``step`` (list of walker blobs) at position ``nsteps``,
+        returning `False` if any blob does not follow the field format.
+        """
+        if self.kind == 'object':
+            self.values.append(step)
+            return True
+
+        if nsteps >= len(self.values):
+            self.values = np.concatenate((self.values,
+                                          np.zeros_like(self.values)), axis=0)
+
+        for walker, blob in enumerate(step):
+            if missing[walker]:
+                continue
+            value = self._value(blob)
+            if value is None:
+                return False
+            self.values[nsteps, walker] = value
+
+        return True
+
+    def get(self, step, walker):
+        if self.kind == 'object':
+            return self.values[step][walker]
+        return self._blob(self.values[step, walker])
+
+    def to_object(self, nsteps, missing):
+        """Convert the field to the ``'object'`` format.
+        """
+        values = [[None if missing[step, walker] else self.get(step, walker)
+                   for walker in range(missing.shape[1])]
+                  for step in range(nsteps)]
+        self.kind = 'object'
+        self.values = values
+
+    def discard(self, start, nsteps):
+        """Drop the first ``start`` of ``nsteps`` stored steps.
+        """
+        if self.kind == 'object':
+            del self.values[:start]
+        else:
+            self.values[:nsteps - start] = self.values[start:nsteps]
+
+
+class _BlobStore(object):
+    """Array-backed replacement for the list of blobs of an emcee sampler.
+
+    It behaves as the list of steps of per-walker blob tuples stored by emcee,
+    but stores each blob index compactly in a `_BlobField`.
+
+    Parameters
+    ----------
+    nwalkers : int
+        Number of walkers.
+    capacity : int, optional
+        Number of steps for which storage is preallocated. The storage is
+        doubled whenever it becomes full.
+    maxlen : int, optional
+        If given, only the last ``maxlen`` steps are kept. Older steps are
+        dropped from the storage once it is full, so that it never grows
+        beyond ``2 * maxlen`` steps.
+    """
+
+    def __init__(self, nwalkers, capacity=100, maxlen=None):
+        self.nwalkers = nwalkers
+        self.maxlen = maxlen
+        if maxlen is not None:
+            capacity = min(capacity, 2 * maxlen)
+        self.capacity = max(int(capacity), 1)
+        # steps before start have been dropped but not yet removed
+        self.start = 0
+        self.nsteps = 0
+        self.fields = None
+        self.missing = np.zeros((self.capacity, nwalkers), dtype=bool)
+
+    def __len__(self):
+        return self.nsteps - self.start
+
+    def _discard(self):
+        """Remove the dropped steps from the start of the storage.
+        """
+        if self.fields is not None:
+            for field in self.fields:
+                field.discard(self.start, self.nsteps)
+        self.missing[:len(self)] = self.missing[self.start:self.nsteps]
+        self.nsteps -= self.start
+        self.start = 0
+
+    def append(self, step):
+        """Add the blobs of all walkers for a new step.
+        """
+        if self.maxlen is not None and len(self) >= self.maxlen:
+            self.start += len(self) - self.maxlen + 1
+
+        if self.nsteps >= len(self.missing):
+            # discard the dropped steps only if they free enough space
+            if self.start > 0 and self.start >= len(self.missing) // 2:
+                self._discard()
+            else:
+                self.missing = np.concatenate(
+                    (self.missing, np.zeros_like(self.missing)), axis=0)
+        missing = np.array([blob is None for blob in step])
+        self.missing[self.nsteps] = missing
+
+        if self.fields is None:
+            if np.all(missing):
+                # all walkers outside of the prior, the fields are created
+                # from the first step with a blob
+                self.nsteps += 1
+                return
+            self._create_fields(step[np.argmin(missing)])
+
+        for idx, field in enumerate(self.fields):
+            fieldstep = [None if blob is None else blob[idx] for blob in step]
+            if not field.set(self.nsteps, fieldstep, missing):
+                field.to_object(self.nsteps, self.missing)
+                field.set(self.nsteps, fieldstep, missing)
+
+        self.nsteps += 1
+
+    def _create_fields(self, blob):
+        """Create the fields from the walker blob ``blob``, with all the
+        steps already stored marked as missing.
+        """
+        self.fields = [_BlobField(value, self.nwalkers, len(self.missing))
+                       for value in blob]
+        for field in self.fields:
+            if field.kind == 'object':
+                field.values = [[None] * self.nwalkers
+                                for step in range(self.nsteps)]
+
+    def extend(self, steps):
+        for step in steps:
+            self.append(step)
+
+    def __getitem__(self, step):
+        if isinstance(step, slice):
+            return [self[i] for i in range(*step.indices(len(self)))]
+        if step < 0:
+            step += len(self)
+        if not 0 <= step < len(self):
+            raise IndexError('blob step index out of range')
+        step += self.start
+
+        return [None if self.missing[step, walker] else
+                tuple(field.get(step, walker) for field in self.fields)
+                for walker in range(self.nwalkers)]
+
+    def __iter__(self):
+        for step in range(len(self)):
+            yield self[step]
+
+    def get_model(self, idx, energy, last_step=True):
+        """Model energies and values for blob index ``idx``, as returned by
+        `naima.plot._process_blob`, or `None` if the blob is not stored as an
+        array.
+        """
+        if self.fields is None:
+            return None
+
+        field = self.fields[idx]
+        if (field.kind == 'object'
+                or np.any(self.missing[self.start:self.nsteps])):
+            return None
+
+        if last_step:
+            values = field.values[self.nsteps - 1]
+        else:
+            values = field.values[self.start:self.nsteps]
+            values = values.reshape((-1,) + values.shape[2:])
+
+        if field.kind == 'pair':
+            modelx = field.x
+        elif field.kind == 'scalar' or field.values.shape[2:] == (1,):
+            modelx = None
+        elif field.values.shape[2:] == energy.shape:
+            modelx = energy
+        else:
+            return None
+
+        if field.unit is None:
+            return modelx, u.Quantity(values)
+
+        return modelx, u.Quantity(values, field.unit)
+
+
+def _use_blob_store(sampler, capacity, maxlen=None):
+    """Replace the blob list of ``sampler`` by a `_BlobStore` with the same
+    content.
+    """
+    store = _BlobStore(sampler.k, capacity, maxlen)
+    store.extend(sampler._blobs)
+    sampler._blobs = store
+
+# Chain retention
+
+
+class _ChainRetention(object):
+    """Storage of the chain of a sampler that keeps only every ``thin``-th
+    step, or only the last ``keep_last`` steps, together with their blobs.
+
+    The steps are stored in arrays preallocated for the thinned steps of a run
+    of ``nrun`` steps, or for ``2 * keep_last`` steps, in which case the
+    retained steps are moved to the start of the arrays whenever they are
+    full. ``sampler._chain`` and ``sampler._lnprob`` are views of the
+    retained steps, so that the chain of the sampler is up to date after each
+    step. Steps already in the chain of the sampler are kept, except those
+    older than the last ``keep_last`` steps.
+    """
+
+    def __init__(self, sampler, nrun, thin=1, keep_last=None):
+        self.sampler = sampler
+        self.thin = max(int(thin), 1)
+        self.keep_last = keep_last
+
+        chain, lnprob = sampler._chain, sampler._lnprob
+        if keep_last is not None:
+            self.keep_last = max(int(keep_last), 1)
+            first = max(chain.shape[1] - self.keep_last, 0)
+            chain, lnprob = chain[:, first:], lnprob[:, first:]
+            capacity = 2 * self.keep_last
+            self._trim_blobs()
+        else:
+            capacity = chain.shape[1] + int(np.ceil(nrun / float(self.thin)))
+
+        self.start = 0
+        self.nsteps = chain.shape[1]
+        self._chain = np.zeros((sampler.k, capacity, sampler.dim))
+        self._lnprob = np.zeros((sampler.k, capacity))
+        self._chain[:, :self.nsteps] = chain
+        self._lnprob[:, :self.nsteps] = lnprob
+        self._update()
+
+    def _update(self):
+        self.sampler._chain = self._chain[:, self.start:self.nsteps]
+        self.sampler._lnprob = self._lnprob[:, self.start:self.nsteps]
+
+    def _trim_blobs(self):
+        # a _BlobStore drops old steps by itself
+        blobs = self.sampler._blobs
+        if isinstance(blobs, list) and len(blobs) > self.keep_last:
+            del blobs[:len(blobs) - self.keep_last]
+
+    def stores(self, iteration):
+        """Whether the step with index ``iteration`` is retained.
+        """
+        return iteration % self.thin == 0
+
+    def append(self, pos, lnprob, blobs=None):
+        """Add a step to the chain of the sampler.
+        """
+        if (self.keep_last is not None
+                and self.nsteps - self.start >= self.keep_last):
+            self.start += 1
+            if self.nsteps >= self._chain.shape[1]:
+                n = self.nsteps - self.start
+                self._chain[:, :n] = self._chain[:, self.start:self.nsteps]
+                self._lnprob[:, :n] = self._lnprob[:, self.start:self.nsteps]
+                self.start, self.nsteps = 0, n
+
+        self._chain[:, self.nsteps] = pos
+        self._lnprob[:, self.nsteps] = lnprob
+        self.nsteps += 1
+        self._update()
+
+        if blobs is not None:
+            self.sampler._blobs.append(list(blobs))
+            if self.keep_last is not None:
+                self._trim_blobs()
+
 # Sampler funcs
 
 
-def _run_mcmc(sampler, pos, nrun):
-    for i, out in enumerate(sampler.sample(pos, iterations=nrun)):
-        progress = (100. * float(i) / float(nrun))
-        if progress % 5 < (5. / float(nrun)):
-            print("\nProgress of the run: {0:.0f} percent"
-                  " ({1} of {2} steps)".format(int(progress), i, nrun))
-            npars = out[0].shape[-1]
-            paravg, parstd = [], []
-            for npar in range(npars):
-                paravg.append(np.median(out[0][:, npar]))
-                parstd.append(np.std(out[0][:, npar]))
-            print("                           " +
-                  (" ".join(["{%i:-^15}" % i for i in range(npars)])
-                   ).format(*sampler.labels))
-            print("  Last ensemble median : " +
-                  (" ".join(["{%i:^15.3g}" % i for i in range(npars)])
-                   ).format(*paravg))
-            print("  Last ensemble std    : " +
-                  (" ".join(["{%i:^15.3g}" % i for i in range(npars)])
-                   ).format(*parstd))
-            print("  Last ensemble lnprob :  avg: {0:.3f}, max: {1:.3f}".format(
-                np.average(out[1]), np.max(out[1])))
+def print_progress(sampler, record):
+    """Print the state of the ensemble every 5% of the run.
+
+    This is the default callback of `get_sampler` and `run_sampler`.
+
+    Parameters
+    ----------
+    sampler : :class:`~emcee.EnsembleSampler` instance
+        Sampler.
+    record : dict
+        Statistics of the last step, see `step_stats_table`.
+    """
+    i, nrun = record['step'], record['nsteps']
+    progress = (100. * float(i) / float(nrun))
+    if progress % 5 < (5. / float(nrun)):
+        print("\nProgress of the run: {0:.0f} percent"
+              " ({1} of {2} steps)".format(int(progress), i, nrun))
+        npars = len(record['median'])
+        print("                           " +
+              (" ".join(["{%i:-^15}" % i for i in range(npars)])
+               ).format(*sampler.labels))
+        print("  Last ensemble median : " +
+              (" ".join(["{%i:^15.3g}" % i for i in range(npars)])
+               ).format(*record['median']))
+        print("  Last ensemble std    : " +
+              (" ".join(["{%i:^15.3g}" % i for i in range(npars)])
+               ).format(*record['std']))
+        print("  Last ensemble lnprob :  avg: {0:.3f}, max: {1:.3f}".format(
+            record['lnprob_mean'], record['lnprob_max']))
+        print("  Acceptance fraction  :  {0:.3f},"
+              " evaluations per second: {1:.1f}".format(
+                  record['acceptance_fraction'],
+                  record['evaluations_per_second']))
+
+
+def _step_record(sampler, step, nsteps, pos, lnprob, wall_time, nevals,
+                 naccepted, times):
+    """Statistics of a single step of the sampler.
+    """
+    record = {'step': step,
+              'nsteps': nsteps,
+              'wall_time': wall_time,
+              'n_evaluations': nevals,
+              'evaluations_per_second': nevals / wall_time if wall_time > 0 else np.inf,
+              'acceptance_fraction': naccepted / float(sampler.k),
+              'lnprob_mean': np.average(lnprob),
+              'lnprob_max': np.max(lnprob),
+              'median': np.median(pos, axis=0),
+              'std': np.std(pos, axis=0),
+              }
+    for name in ['prior', 'model', 'likelihood']:
+        if times is None or wall_time <= 0:
+            record['time_fraction_' + name] = np.nan
+        else:
+            record['time_fraction_' + name] = times[name] / wall_time
+
+    return record
+
+
+def _autocorr_function(x):
+    """Normalized autocorrelation function of the rows of ``x``, averaged
+    over rows, computed with FFTs.
+    """
+    n = x.shape[1]
+    nfft = 2 ** int(np.ceil(np.log2(2 * n)))
+    x = x - np.mean(x, axis=1)[:, np.newaxis]
+    f = np.fft.fft(x, n=nfft, axis=1)
+    acf = np.fft.ifft(f * np.conjugate(f), axis=1)[:, :n].real
+    var = acf[:, 0]
+    # walkers that did not move carry no information
+    acf = acf[var > 0] / var[var > 0][:, np.newaxis]
+    if len(acf) == 0:
+        return np.nan * np.ones(n)
+    return np.mean(acf, axis=0)
+
+
+def _integrated_time(chain, c=5):
+    """Integrated autocorrelation time of each parameter of an ensemble chain
+    with shape ``(nwalkers, nsteps, ndim)``.
+
+    The autocorrelation function is averaged over walkers, and summed up to
+    the smallest window ``M`` with ``M >= c * tau(M)`` (Sokal 1997).
+    """
+    tau = []
+    for k in range(chain.shape[2]):
+        taus = 2. * np.cumsum(_autocorr_function(chain[:, :, k])) - 1.
+        window = np.arange(len(taus)) >= c * taus
+        if np.any(window):
+            tau.append(taus[np.argmax(window)])
+        else:
+            tau.append(taus[-1])
+    return np.array(tau)
+
+
+class _AutocorrStop(object):
+    """Callback that stops the run once the chain is longer than ``factor``
+    times the autocorrelation time of every parameter, and the autocorrelation
+    time estimates changed by less than a relative ``tol`` since the previous
+    check. Estimates are computed every ``every`` steps and stored in
+    ``sampler.autocorr_history``.
+    """
+
+    def __init__(self, factor=50, every=50, tol=0.05):
+        self.factor = factor
+        self.every = max(int(every), 1)
+        self.tol = tol
+        self.tau = None
+
+    def __call__(self, sampler, record):
+        nsteps = sampler.iterations
+        if nsteps % self.every != 0:
+            return False
+
+        # the autocorrelation time of a thinned chain is in units of
+        # retained steps
+        tau = (_integrated_time(sampler.chain[:, :nsteps])
+               * getattr(sampler, 'thin', 1))
+        if not hasattr(sampler, 'autocorr_history'):
+            sampler.autocorr_history = []
+        sampler.autocorr_history.append((nsteps, tau))
+
+        converged = (self.tau is not None
+                     and np.all(nsteps > self.factor * tau)
+                     and np.all(np.abs(self.tau - tau) < self.tol * tau))
+        self.tau = tau
+
+        if converged:
+            print('\nChain converged after {0} steps, autocorrelation times: '
+                  '{1}'.format(nsteps, ', '.join(
+                      '{0:.3g}'.format(t) for t in tau)))
+
+        return converged
+
+
+def _run_mcmc(sampler, pos, nrun, lnprob0=None, blobs0=None, checkpoint=None,
+              callbacks=None, retention=None):
+    if callbacks is None:
+        callbacks = [print_progress, ]
+    if not hasattr(sampler, 'step_stats'):
+        sampler.step_stats = []
+
+    stats = getattr(sampler, 'eval_stats', None)
+
+    def snapshot():
+        if stats is None:
+            return 0, None
+        return stats.nevals, dict(stats.time)
+
+    i0 = sampler.chain.shape[1]
+    stopped = False
+
+    try:
+        t0 = time.time()
+        nevals0, times0 = snapshot()
+        naccepted0 = np.sum(sampler.naccepted)
+        for i, out in enumerate(sampler.sample(
+                pos, lnprob0=lnprob0, blobs0=blobs0, iterations=nrun,
+                storechain=retention is None)):
+            t1 = time.time()
+            nevals1, times1 = snapshot()
+            naccepted1 = np.sum(sampler.naccepted)
+
+            if nevals1 > nevals0:
+                nevals = nevals1 - nevals0
+                times = dict((name, times1[name] - times0[name])
+                             for name in times1)
+            else:
+                # evaluations in other processes are not recorded
+                nevals, times = sampler.k, None
+
+            record = _step_record(sampler, i, nrun, out[0], out[1], t1 - t0,
+                                  nevals, naccepted1 - naccepted0, times)
+            sampler.step_stats.append(record)
+
+            if retention is None:
+                stored = True
+            else:
+                stored = retention.stores(sampler.iterations - 1)
+                if stored:
+                    retention.append(out[0], out[1],
+                                     out[3] if len(out) > 3 else None)
+
+            if checkpoint is not None and stored:
+                checkpoint.append(sampler, *out)
+
+            for callback in callbacks:
+                if callback(sampler, record):
+                    stopped = True
+
+            if stopped:
+                break
+
+            t0, nevals0, times0, naccepted0 = t1, nevals1, times1, naccepted1
+    finally:
+        if checkpoint is not None:
+            checkpoint.flush()
+
+    if stopped and retention is None:
+        # remove the space preallocated by emcee for the remaining steps
+        sampler._chain = sampler._chain[:, :i0 + i + 1]
+        sampler._lnprob = sampler._lnprob[:, :i0 + i + 1]
+
     return sampler, out[0]
 
 
+def step_stats_table(sampler):
+    """Table of the per-step statistics of the last run of a sampler.
+
+    Each step of `run_sampler` (and of the burn-in in `get_sampler`) stores a
+    record in ``sampler.step_stats``, which is also passed to the callbacks
+    given to these functions. The records contain:
+
+    - ``step`` and ``nsteps``: step number and total number of steps of the
+      run.
+    - ``wall_time``: wall time of the step in seconds.
+    - ``n_evaluations`` and ``evaluations_per_second``: number and rate of
+      log-probability evaluations.
+    - ``acceptance_fraction``: fraction of walkers whose proposal was
+      accepted in the step.
+    - ``time_fraction_prior``, ``time_fraction_model``, and
+      ``time_fraction_likelihood``: fraction of the wall time spent in the
+      prior, model, and likelihood functions. When several processes are
+      used (``threads`` > 1), these are summed over processes and can be
+      larger than one. They are NaN for samplers with a pool that does not
+      report them.
+    - ``lnprob_mean`` and ``lnprob_max``: mean and maximum log-probability of
+      the ensemble.
+    - ``median`` and ``std``: median and standard deviation of the walker
+      positions for each parameter.
+
+    Parameters
+    ----------
+    sampler : :class:`~emcee.EnsembleSampler` instance
+        Sampler.
+
+    Returns
+    -------
+    table : `~astropy.table.Table`
+        Table with one row per step and one column per record field.
+    """
+    from astropy.table import Table
+
+    names = ['step', 'nsteps', 'wall_time', 'n_evaluations',
+             'evaluations_per_second', 'acceptance_fraction',
+             'time_fraction_prior', 'time_fraction_model',
+             'time_fraction_likelihood', 'lnprob_mean', 'lnprob_max',
+             'median', 'std']
+
+    records = getattr(sampler, 'step_stats', [])
+    if len(records) == 0:
+        return Table(names=names)
+
+    return Table([np.array([record[name] for record in records])
+                  for name in names], names=names)
+
+
+def _lnprob_function(data, model, prior, likelihood, vectorize):
+    """Log-probability of a single parameter vector."""
+    if vectorize:
+        def func(pars):
+            return lnprob_vectorized(np.atleast_2d(pars), data, model, prior,
+                                     likelihood=likelihood)[0][0]
+    else:
+        def func(pars):
+            return lnprob(pars, data, model, prior, likelihood=likelihood)[0]
+    return func
+
+
+def _find_map(func, p0, step=1e-3):
+    """Find the maximum a posteriori parameter vector and the covariance of
+    the posterior around it.
+
+    The negative log-probability is minimized with the Nelder-Mead method,
+    which does not need gradients and handles parameter vectors outside of
+    the prior bounds. The parameters are scaled by the absolute value of the
+    initial position so that all of them are of order unity. The covariance
+    is the inverse of the Hessian of the negative log-probability, computed
+    with central finite differences of relative size ``step`` at the mode.
+
+    Returns
+    -------
+    result : `~scipy.optimize.OptimizeResult`
+        Result of the minimization, with the mode in the original parameter
+        space as ``x``, the log-probability at the mode as ``lnprob``, and the
+        covariance as ``cov``. The covariance is `None` if the Hessian is not
+        positive definite at the mode.
+    """
+    from scipy.optimize import minimize
+
+    p0 = np.asarray(p0, dtype=float)
+    scale = np.where(p0 != 0, np.abs(p0), 1.)
+
+    def negfunc(x):
+        lnp = func(x * scale)
+        return np.inf if np.isnan(lnp) else -lnp
+
+    result = minimize(negfunc, p0 / scale, method='Nelder-Mead')
+    xmap = result.x
+    fmap = result.fun
+
+    # Hessian of the negative log-probability in the scaled space
+    ndim = len(p0)
+    h = step * np.where(xmap != 0, np.abs(xmap), 1.)
+    hess = np.zeros((ndim, ndim))
+    for i in range(ndim):
+        di = np.zeros(ndim)
+        di[i] = h[i]
+        hess[i, i] = (negfunc(xmap + di) - 2 * fmap
+                      + negfunc(xmap - di)) / h[i] ** 2
+        for j in range(i):
+            dj = np.zeros(ndim)
+            dj[j] = h[j]
+            hess[i, j] = hess[j, i] = (negfunc(xmap + di + dj)
+                                       - negfunc(xmap + di - dj)
+                                       - negfunc(xmap - di + dj)
+                                       + negfunc(xmap - di - dj)) / (
+                                           4 * h[i] * h[j])
+
+    cov = None
+    if np.all(np.isfinite(hess)):
+        try:
+            # Cholesky factorization fails if not positive definite
+            np.linalg.cholesky(hess)
+            cov = np.linalg.inv(hess) * np.outer(scale, scale)
+        except np.linalg.LinAlgError:
+            pass
+
+    result.x = xmap * scale
+    result.lnprob = -fmap
+    result.cov = cov
+    return result
+
+
+def _init_walkers(p0, cov, nwalkers, prior=None, vectorize=False,
+                  maxtries=20):
+    """Draw walker positions from a multivariate gaussian around ``p0``.
+
+    Positions outside of the prior bounds are drawn again from a gaussian
+    with half the covariance, up to ``maxtries`` times.
+    """
+    pos = np.random.multivariate_normal(p0, cov, nwalkers)
+    if prior is None:
+        return pos
+
+    def outside(pos):
+        if vectorize:
+            lnp = np.zeros(len(pos)) + prior(pos)
+        else:
+            lnp = np.array([prior(p) for p in pos])
+        return np.where(~np.isfinite(lnp))[0]
+
+    bad = outside(pos)
+    for i in range(maxtries):
+        if len(bad) == 0:
+            break
+        cov = cov / 2.
+        pos[bad] = np.random.multivariate_normal(p0, cov, len(bad))
+        bad = bad[outside(pos[bad])]
+    else:
+        pos[bad] = p0
+
+    return pos
+
+
 def get_sampler(data_table=None, p0=None, model=None, prior=None,
                 nwalkers=500, nburn=100,
-                guess=True, labels=None, threads=4):
+                guess=True, labels=None, threads=4, vectorize=False,
+                callbacks=None, pool=None, prefit=False):
     """Generate a new MCMC sampler.
 
     Parameters
@@ -174,7 +1448,7 @@ def get_sampler(data_table=None, p0=None, model=None, prior=None,
     p0 : array
         Initial position vector. The distribution for the ``nwalkers`` walkers
         will be computed as a multidimensional gaussian of width 5% around the
-        initial position vector ``p0``.
+        initial position vector ``p0``, unless ``prefit`` is True.
     model : function
         A function that takes a vector in the parameter space and the data
         dictionary, and returns the expected fluxes at the energies in the
@@ -182,11 +1456,14 @@ def get_sampler(data_table=None, p0=None, model=None, prior=None,
         sampler chain, see `the emcee documentation for the
         format
         <http://dan.iel.fm/emcee/current/user/advanced/#arbitrary-metadata-blobs>`_.
+        If ``vectorize`` is True, see below.
     prior : function, optional
         A function that takes a vector in the parameter space and returns the
         log-likelihood of the Bayesian prior. Parameter limits can be specified
         through a uniform prior, returning 0. if the vector is within the
-        parameter bounds and ``-np.inf`` otherwise.
+        parameter bounds and ``-np.inf`` otherwise. A `Prior` instance can be
+        used to build the prior from uniform and normal terms for each
+        parameter.
     nwalkers : int, optional
         The number of Goodman & Weare “walkers”. Default is 500.
     nburn : int, optional
@@ -197,10 +1474,41 @@ def get_sampler(data_table=None, p0=None, model=None, prior=None,
         Labels for the parameters included in the position vector ``p0``. If not
         provided ``['par1','par2', ... ,'parN']`` will be used.
     threads : int, optional
-        Number of threads to use for sampling. Default is 4.
+        Number of processes to use for sampling. The data, model and prior are
+        sent to each worker process once, and the walker positions are split
+        in one chunk per process at each ensemble update. Default is 4.
     guess : bool, optional
         Whether to attempt to guess the normalization (first) parameter of the
         model. Default is True.
+    vectorize : bool, optional
+        Whether the ``model`` and ``prior`` functions are vectorized. If True,
+        they will be called once per ensemble update with a ``(nwalkers,
+        ndim)`` array of parameter vectors. The model function must then return
+        the expected fluxes as an array with shape ``(nwalkers, ndata)``, and
+        each additional return object must be indexable by walker along its
+        first axis. The prior function must return an array with shape
+        ``(nwalkers,)``. The ``threads`` argument is ignored. Default is False.
+    callbacks : list of functions, optional
+        Functions called after each burn-in step as ``callback(sampler,
+        record)``, where ``record`` is a dictionary with the statistics of the
+        step (see `step_stats_table`). If any callback returns True, the
+        burn-in is stopped. Default is ``[print_progress]``.
+    pool : object, optional
+        Pool used to evaluate the log-probability of the walkers instead of
+        the processes given by ``threads``, e.g., a `SocketPool`. It must
+        have a ``map(func, positions)`` method, and if it has a ``start(data,
+        model, prior, stats)`` method, it is called before sampling. It
+        cannot be used with ``vectorize``.
+    prefit : bool, optional
+        Whether to find the maximum a posteriori (MAP) parameter vector with a
+        Nelder-Mead minimization of the negative log-probability starting from
+        ``p0`` before the burn-in. The walkers are then drawn from a
+        multivariate gaussian around the MAP vector, with the covariance given
+        by the inverse of the Hessian of the log-probability at the MAP
+        vector, which usually allows for a much shorter burn-in. If the
+        Hessian is not positive definite, a gaussian of width 5% around the
+        MAP vector is used. The result of the minimization is stored as the
+        ``map_result`` attribute of the sampler. Default is False.
 
     Returns
     -------
@@ -225,6 +1533,11 @@ def get_sampler(data_table=None, p0=None, model=None, prior=None,
     if model is None:
         raise TypeError ('Model function is missing!')
 
+    if pool is not None and vectorize:
+        raise ValueError('A pool cannot be used with vectorize=True, the '
+                         'vectorized log-probability of all walkers is '
+                         'evaluated in a single call')
+
     # Add parameter labels if not provided or too short
     if labels is None:
         # First is normalization
@@ -234,12 +1547,10 @@ def get_sampler(data_table=None, p0=None, model=None, prior=None,
 
     if guess:
         # guess normalization parameter from p0
-        modelout = model(p0, data)
-        if ((type(modelout) == tuple or type(modelout) == list)
-                and (type(modelout) != np.ndarray)):
-            spec = modelout[0]
+        if vectorize:
+            spec = _split_modelout(model(np.atleast_2d(p0), data))[0][0]
         else:
-            spec = modelout
+            spec = _split_modelout(model(p0, data))[0]
 
         nunit, sedf = sed_conversion(data['energy'],spec.unit,False)
         p0[labels.index('norm')] *= (
@@ -249,34 +1560,88 @@ def get_sampler(data_table=None, p0=None, model=None, prior=None,
 
     ndim = len(p0)
 
-    sampler = emcee.EnsembleSampler(nwalkers, ndim, lnprob,
-                                    args=[data, model, prior], threads=threads)
+    stats = _EvalStats()
+    if pool is not None:
+        if hasattr(pool, 'start'):
+            pool.start(data, model, prior, stats=stats)
+    elif vectorize:
+        pool = _VectorizedPool()
+    elif threads > 1:
+        # Evaluate the model once before starting the workers so that they
+        # inherit warm caches
+        model(p0, data)
+        pool = _WorkerPool(threads, data, model, prior, stats=stats)
+    else:
+        pool = None
+
+    # Compile the data into a unit-free layout for the likelihood
+    likelihood = _LikelihoodData(data)
+
+    sampler = emcee.EnsembleSampler(nwalkers, ndim,
+                                    lnprob_vectorized if vectorize else lnprob,
+                                    args=[data, model, prior],
+                                    kwargs={'stats': stats,
+                                            'likelihood': likelihood},
+                                    pool=pool)
+    sampler.eval_stats = stats
+    sampler.likelihood = likelihood
 
     # Add data and parameters properties to sampler
     sampler.data_table = data_table
     sampler.data = data
     sampler.labels = labels
 
-    # Initialize walkers in a ball of relative size 5% in all dimensions
-    p0var = np.array([0.05 * pp for pp in p0])
-    p0 = emcee.utils.sample_ball(p0, p0var, nwalkers)
+    if prefit:
+        func = _lnprob_function(data, model, prior, likelihood, vectorize)
+        print('Finding the maximum a posteriori parameter vector...')
+        map_result = _find_map(func, p0)
+        sampler.map_result = map_result
+        print('Maximum log-probability {0:.3g} at {1} after {2} '
+              'evaluations'.format(map_result.lnprob, map_result.x,
+                                   map_result.nfev))
+        p0 = map_result.x
+
+    if prefit and map_result.cov is not None:
+        # Initialize walkers from the local covariance around the mode
+        p0 = _init_walkers(p0, map_result.cov, nwalkers, prior, vectorize)
+    else:
+        # Initialize walkers in a ball of relative size 5% in all dimensions
+        p0var = np.array([0.05 * pp for pp in p0])
+        p0 = emcee.utils.sample_ball(p0, p0var, nwalkers)
 
     if nburn > 0:
         print(
             'Burning in the {0} walkers with {1} steps...'.format(nwalkers, nburn))
-        sampler, pos = _run_mcmc(sampler, p0, nburn)
+        sampler, pos = _run_mcmc(sampler, p0, nburn, callbacks=callbacks)
     else:
         pos = p0
 
     return sampler, pos
 
 
-def run_sampler(nrun=100, sampler=None, pos=None, **kwargs):
+def run_sampler(nrun=100, sampler=None, pos=None, checkpoint=None,
+                checkpoint_every=10, compact_blobs=True, callbacks=None,
+                autocorr_factor=None, autocorr_every=50, autocorr_tol=0.05,
+                thin=1, keep_last=None, **kwargs):
     """Run an MCMC sampler.
 
     If no sampler or initial position vector is provided, extra ``kwargs`` are
     passed to `get_sampler` to generate a new sampler.
 
+    If a ``checkpoint`` directory is given, the walker positions,
+    log-probabilities and blobs are written to disk every ``checkpoint_every``
+    steps. If the directory already contains steps from a previous run with
+    the same number of walkers and parameters (e.g., one that was
+    interrupted), the run is resumed after the last stored step, skipping the
+    burn-in, until a total of ``nrun`` steps is reached. The returned sampler
+    contains the full chain, including the steps read from disk.
+
+    The memory used by the chain and blobs of long runs can be bounded by
+    keeping only every ``thin``-th step, or only the last ``keep_last``
+    steps. ``sampler.iterations`` is then the number of steps run, and
+    ``sampler.chain``, ``sampler.lnprobability`` and ``sampler.blobs`` only
+    contain the retained steps.
+
     Parameters
     ----------
     nrun : int, optional
@@ -288,6 +1653,46 @@ def run_sampler(nrun=100, sampler=None, pos=None, **kwargs):
         dimensions of ``(nwalkers,dim)``, where ``dim`` is the number of free
         parameters. `emcee.utils.sample_ball` can be used to generate a
         multidimensional gaussian distribution around a single initial position.
+    checkpoint : str, optional
+        Directory where the chain is stored during the run. It will be created
+        if it does not exist. Default is `None`, i.e., no checkpoints.
+    checkpoint_every : int, optional
+        Number of steps written to each checkpoint chunk. Default is 10.
+    compact_blobs : bool, optional
+        Whether to store the blobs in preallocated arrays instead of nested
+        lists of Quantities. Blobs that are Quantity arrays, ``(energy,
+        flux)`` pairs with a fixed energy array, or scalars are stored in a
+        single array per blob index, with their unit and energy array kept
+        only once. ``sampler.blobs`` can still be indexed as a list of steps of
+        per-walker blob tuples. Default is True.
+    callbacks : list of functions, optional
+        Functions called after each step as ``callback(sampler, record)``,
+        where ``record`` is a dictionary with the statistics of the step (see
+        `step_stats_table`). The records of all steps are also stored in
+        ``sampler.step_stats``. If any callback returns True, the run is
+        stopped. Default is ``[print_progress]``.
+    autocorr_factor : float, optional
+        If given, the integrated autocorrelation time of each parameter is
+        estimated every ``autocorr_every`` steps, and the run is stopped once
+        the chain is longer than ``autocorr_factor`` times the autocorrelation
+        times and their estimates changed by less than a relative
+        ``autocorr_tol`` since the previous estimate. ``nrun`` is then the
+        maximum number of steps. The estimates are stored in
+        ``sampler.autocorr_history`` as a list of ``(nsteps, tau)`` tuples.
+        Default is `None`, i.e., always run ``nrun`` steps.
+    autocorr_every : int, optional
+        Number of steps between autocorrelation time estimates. Default is 50.
+    autocorr_tol : float, optional
+        Relative tolerance for the change of the autocorrelation time
+        estimates. Default is 0.05.
+    thin : int, optional
+        Only keep every ``thin``-th step of the walkers and their blobs, both
+        in memory and in the checkpoint. Default is 1, i.e., keep all steps.
+    keep_last : int, optional
+        If given, only keep the last ``keep_last`` steps of the walkers and
+        their blobs in memory. All steps are still written to the checkpoint,
+        but only the last ``keep_last`` steps are read on resume. Default is
+        `None`, i.e., keep all steps.
 
     Returns
     -------
@@ -297,11 +1702,211 @@ def run_sampler(nrun=100, sampler=None, pos=None, **kwargs):
         List of final position vectors after the run.
     """
 
-    if sampler is None or pos is None:
-        sampler, pos = get_sampler(**kwargs)
+    kwargs['callbacks'] = callbacks
+
+    stored = None
+    if checkpoint is not None:
+        checkpoint = _ChainCheckpoint(checkpoint, checkpoint_every)
+        stored = checkpoint.load(keep_last)
+
+    if stored is not None:
+        if sampler is None:
+            # walkers are restored from the checkpoint: skip burn-in, guess
+            # and pre-fit
+            kwargs.update(nburn=0, guess=False, prefit=False)
+            sampler, pos = get_sampler(**kwargs)
+        _ChainCheckpoint.restore(sampler, stored)
+        pos = stored['chain'][:, -1]
+        lnprob0 = np.array(stored['lnprobability'][:, -1])
+        blobs0 = stored['blobs'][-1]
+        if blobs0 is not None:
+            blobs0 = list(blobs0)
+        nrun_left = nrun - sampler.iterations
+        print('\nResuming run from checkpoint at step {0}, running {1} '
+              'steps...'.format(sampler.iterations, max(nrun_left, 0)))
+    else:
+        if sampler is None or pos is None:
+            sampler, pos = get_sampler(**kwargs)
+        lnprob0, blobs0 = None, None
+        nrun_left = nrun
+        print('\nWalker burn in finished, running {0} steps...'.format(nrun))
+        sampler.reset()
+
+    thin = max(int(thin), 1)
+    sampler.thin = thin
+    if compact_blobs:
+        _use_blob_store(sampler, int(np.ceil(nrun / float(thin))), keep_last)
+    sampler.step_stats = []
+
+    if thin > 1 or keep_last is not None:
+        retention = _ChainRetention(sampler, nrun_left, thin, keep_last)
+    else:
+        retention = None
+
+    if autocorr_factor is not None:
+        if callbacks is None:
+            callbacks = [print_progress, ]
+        sampler.autocorr_history = []
+        callbacks = list(callbacks) + [_AutocorrStop(
+            autocorr_factor, autocorr_every, autocorr_tol)]
 
-    print('\nWalker burn in finished, running {0} steps...'.format(nrun))
-    sampler.reset()
-    sampler, pos = _run_mcmc(sampler, pos, nrun)
+    if nrun_left > 0:
+        sampler, pos = _run_mcmc(sampler, pos, nrun_left, lnprob0=lnprob0,
+                                 blobs0=blobs0, checkpoint=checkpoint,
+                                 callbacks=callbacks, retention=retention)
 
     return sampler, pos
+
+# Batch fitting
+
+
+def _save_fit(fname, sampler):
+    """Write the chain of ``sampler`` to the ``npz`` file ``fname``.
+
+    The file is written to a temporary name first and renamed, so that only
+    complete results are found when resuming a batch.
+    """
+    with open(fname + '.tmp', 'wb') as f:
+        np.savez(f, chain=sampler.chain, lnprobability=sampler.lnprobability,
+                 acceptance_fraction=sampler.acceptance_fraction,
+                 labels=np.array(sampler.labels))
+    os.rename(fname + '.tmp', fname)
+
+
+def _batch_fit(task):
+    """Fit a single source of a batch, retrying up to ``retries`` times.
+
+    Runs in the worker processes of `run_batch`, and returns the name of the
+    source, the number of attempts, and the error message of the last failed
+    attempt, or `None` on success.
+    """
+    import traceback
+    import shutil
+
+    name, outdir, retries, keep_checkpoints, kwargs = task
+    fname = os.path.join(outdir, name + '.npz')
+    failname = os.path.join(outdir, name + '.failed')
+    checkpoint = os.path.join(outdir, name + '_checkpoint')
+
+    for attempt in range(1, retries + 2):
+        try:
+            sampler, pos = run_sampler(checkpoint=checkpoint, **kwargs)
+            _save_fit(fname, sampler)
+        except Exception as exc:
+            error = '{0}: {1}'.format(type(exc).__name__, exc)
+            with open(failname, 'w') as f:
+                f.write('Attempt {0} failed\n'.format(attempt))
+                f.write(traceback.format_exc())
+        else:
+            if os.path.exists(failname):
+                os.remove(failname)
+            if not keep_checkpoints:
+                shutil.rmtree(checkpoint, ignore_errors=True)
+            return name, attempt, None
+
+    return name, attempt, error
+
+
+def run_batch(data_tables, outdir, processes=None, retries=1,
+              keep_checkpoints=False, **kwargs):
+    """Fit a catalogue of sources in parallel.
+
+    Each source is fit with `run_sampler` in a separate worker process, using
+    the extra ``kwargs`` (e.g., ``p0``, ``labels``, ``model``, ``prior``,
+    ``nwalkers``, ``nburn``, ``nrun``) for all sources. The walker chain of
+    each finished fit is written to ``<outdir>/<name>.npz``, with the
+    ``chain``, ``lnprobability``, ``acceptance_fraction`` and ``labels`` of
+    the sampler.
+
+    Sources whose result file already exists are skipped, so that an
+    interrupted batch is resumed by calling `run_batch` again with the same
+    arguments. The chain of each running fit is also checkpointed in
+    ``<outdir>/<name>_checkpoint`` (see `run_sampler`), so that fits that
+    were interrupted are resumed after their last stored step. A fit that
+    raises an exception is retried up to ``retries`` times, resuming from its
+    checkpoint, and the traceback of the last failure is written to
+    ``<outdir>/<name>.failed``. Failed sources are attempted again in the next
+    call to `run_batch`. The checkpoint of a fit is deleted once its result
+    file is written, unless ``keep_checkpoints`` is True.
+
+    The model and prior functions are sent to the worker processes, so they
+    must be picklable, i.e., defined at the top level of a module.
+
+    Parameters
+    ----------
+    data_tables : dict or list of `~astropy.table.Table`
+        Data tables of the sources. If a dictionary, its keys are used as
+        source names in the result file names. If a list, the sources are
+        named ``source_0000``, ``source_0001``, etc.
+    outdir : str
+        Directory where the results are stored. It will be created if it does
+        not exist.
+    processes : int, optional
+        Number of worker processes. Default is the number of CPUs. Each fit
+        runs in a single process, i.e., the ``threads`` argument of
+        `get_sampler` is ignored.
+    retries : int, optional
+        Number of times a failed fit is retried. Default is 1.
+    keep_checkpoints : bool, optional
+        Whether to keep the checkpoint directory of each finished fit, which
+        contains its full chain and blobs. Default is False.
+
+    Returns
+    -------
+    results : `~astropy.table.Table`
+        Table with the ``name`` of each source, the ``status`` of its fit
+        (``done``, ``skipped`` if a result file was found, or ``failed``), the
+        number of ``attempts``, and the ``error`` message of failed fits.
+    """
+    from multiprocessing import Pool
+    from astropy.table import Table
+
+    if isinstance(data_tables, dict):
+        names = sorted(data_tables)
+    else:
+        data_tables = list(data_tables)
+        names = ['source_{0:04d}'.format(i) for i in range(len(data_tables))]
+        data_tables = dict(zip(names, data_tables))
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    # The workers of a Pool cannot start processes of their own, and the
+    # progress of concurrent fits would be interleaved in the output
+    kwargs.update(threads=1, pool=None)
+    kwargs.setdefault('callbacks', [])
+
+    results = {}
+    tasks = []
+    for name in names:
+        if os.path.exists(os.path.join(outdir, name + '.npz')):
+            results[name] = ('skipped', 0, '')
+        else:
+            task_kwargs = dict(kwargs, data_table=data_tables[name])
+            tasks.append((name, outdir, retries, keep_checkpoints,
+                          task_kwargs))
+
+    log.info('Fitting {0} sources, {1} found in {2}'.format(
+        len(tasks), len(names) - len(tasks), outdir))
+
+    if len(tasks) > 0:
+        pool = Pool(processes)
+        try:
+            for name, attempts, error in pool.imap_unordered(_batch_fit,
+                                                             tasks):
+                if error is None:
+                    results[name] = ('done', attempts, '')
+                else:
+                    results[name] = ('failed', attempts, error)
+                    log.warning('Fit of source {0} failed after {1} attempts:'
+                                ' {2}'.format(name, attempts, error))
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    return Table([names] + [[results[name][i] for name in names]
+                            for i in range(3)],
+                 names=['name', 'status', 'attempts', 'error'])
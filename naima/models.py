@@ -26,7 +26,56 @@ def _validate_ene(ene):
 
     return ene
 
-class PowerLaw(object):
+class BoundFunction(object):
+    """Model function bound to a fixed energy array.
+
+    Use the ``bind`` method of the model functions to create instances.
+    Calling the bound function evaluates the model for the current values of
+    its parameters at the bound energies, without validating the energy array
+    again.
+
+    Parameters
+    ----------
+    function : model function instance
+        Model function, e.g., `PowerLaw`.
+    e : `~astropy.units.Quantity` array
+        Energy array.
+    """
+
+    def __init__(self, function, e):
+        self.function = function
+        self.e = _validate_ene(e)
+        self._e = self.e.to('eV').value
+
+    def __call__(self):
+        params = []
+        for name in self.function.param_names:
+            value = getattr(self.function, name)
+            if (name != 'amplitude' and isinstance(value, u.Quantity)
+                    and value.unit.physical_type == 'energy'):
+                value = value.to('eV').value
+            params.append(value)
+
+        return self.function.eval(self._e, *params)
+
+class _BaseFunction(object):
+    def bind(self, e):
+        """Bind the model function to a fixed energy array.
+
+        Parameters
+        ----------
+        e : `~astropy.units.Quantity` array
+            Energy array.
+
+        Returns
+        -------
+        bound : BoundFunction
+            Function taking no arguments which returns the model evaluated at
+            ``e``.
+        """
+        return BoundFunction(self, e)
+
+class PowerLaw(_BaseFunction):
     """
     One dimensional power law model.
 
@@ -75,7 +124,7 @@ class PowerLaw(object):
                 self.e_0.to('eV').value, self.alpha)
 
 
-class ExponentialCutoffPowerLaw(object):
+class ExponentialCutoffPowerLaw(_BaseFunction):
     """
     One dimensional power law model with an exponential cutoff.
 
@@ -130,7 +179,7 @@ class ExponentialCutoffPowerLaw(object):
                 self.e_0.to('eV').value, self.alpha,
                 self.e_cutoff.to('eV').value, self.beta)
 
-class BrokenPowerLaw(object):
+class BrokenPowerLaw(_BaseFunction):
     """
     One dimensional power law model with a break.
 
@@ -191,7 +240,7 @@ class BrokenPowerLaw(object):
                 self.e_0.to('eV').value, self.e_break.to('eV').value,
                 self.alpha_1, self.alpha_2)
 
-class ExponentialCutoffBrokenPowerLaw(object):
+class ExponentialCutoffBrokenPowerLaw(_BaseFunction):
     """
     One dimensional power law model with a break.
 
@@ -234,7 +283,8 @@ class ExponentialCutoffBrokenPowerLaw(object):
 
     """
 
-    param_names = ['amplitude', 'e_0', 'e_break', 'alpha_1', 'alpha_2']
+    param_names = ['amplitude', 'e_0', 'e_break', 'alpha_1', 'alpha_2',
+                   'e_cutoff', 'beta']
 
     def __init__(self, amplitude, e_0, e_break, alpha_1, alpha_2, e_cutoff, beta=1.0):
         self.amplitude = amplitude
@@ -263,7 +313,7 @@ class ExponentialCutoffBrokenPowerLaw(object):
                 self.alpha_1, self.alpha_2, self.e_cutoff.to('eV').value,
                 self.beta)
 
-class LogParabola(object):
+class LogParabola(_BaseFunction):
     """
     One dimensional log parabola model (sometimes called curved power law).
 
@@ -9,6 +9,7 @@ from astropy import log
 from astropy import table
 
 from .utils import sed_conversion, validate_data_table
+from .core import _BlobStore
 
 __all__ = ["plot_chain", "plot_fit", "plot_data", "plot_blob"]
 
@@ -194,6 +195,12 @@ def _process_blob(sampler, modelidx,last_step=True):
     - a Quantity scalar: return array of scalars
     """
 
+    if isinstance(sampler.blobs, _BlobStore):
+        out = sampler.blobs.get_model(modelidx, sampler.data['energy'],
+                                      last_step=last_step)
+        if out is not None:
+            return out
+
     blob0 = sampler.blobs[-1][0][modelidx]
     if isinstance(blob0, u.Quantity):
         if blob0.size == sampler.data['energy'].size:
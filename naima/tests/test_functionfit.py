@@ -121,3 +121,396 @@ def test_init_exception_data():
         sampler, pos = get_sampler(p0=p0, labels=labels, model=cutoffexp,
                                    prior=lnprior, nwalkers=10, nburn=0, threads=1)
 
+
+def cutoffexp_vectorized(pars, data):
+    """
+    Powerlaw with exponential cutoff evaluated for an ensemble of parameter
+    vectors
+    """
+
+    x = data['energy'].to('TeV').value
+    x0 = np.sqrt(x[0] * x[-1])
+
+    N = np.vstack(pars[:, 0])
+    gamma = np.vstack(pars[:, 1])
+    ecut = np.vstack(pars[:, 2])
+
+    return N * (x / x0) ** -gamma * np.exp(-(x / ecut)) * u.Unit('1/(cm2 s TeV)')
+
+def lnprior_vectorized(pars):
+    logprob = (np.where(pars[:, 0] > 0, 0., -np.inf)
+               + normal_prior(pars[:, 1], 1.4, 0.5)
+               + np.where(pars[:, 2] > 0, 0., -np.inf))
+
+    return logprob
+
+@pytest.mark.skipif('not HAS_EMCEE')
+def test_vectorized_lnprob():
+    from ..core import lnprob, lnprob_vectorized
+    from ..utils import validate_data_table
+
+    for table in [data_table, data_table2]:
+        data = validate_data_table(table)
+        pars = emcee.utils.sample_ball(p0, 0.05 * p0, 10)
+        pars[3, 2] = -1.
+
+        lnprobs, blobs = lnprob_vectorized(pars, data, cutoffexp_vectorized,
+                                           lnprior_vectorized)
+
+        for i, par in enumerate(pars):
+            lnp, blob = lnprob(par, data, cutoffexp, lnprior)
+            assert np.allclose(lnprobs[i], lnp)
+            if blob is None:
+                assert blobs[i] is None
+            else:
+                assert np.allclose(blobs[i][0].value, blob[0].value)
+
+@pytest.mark.skipif('not HAS_EMCEE')
+def test_vectorized_sampler():
+    sampler, pos = run_sampler(
+        data_table=data_table, p0=p0, labels=labels,
+        model=cutoffexp_vectorized, prior=lnprior_vectorized, nwalkers=10,
+        nrun=10, nburn=2, vectorize=True)
+
+    assert sampler.chain.shape == (10, 10, 3)
+    assert len(sampler.blobs) == 10
+    assert sampler.blobs[-1][0][0].shape == data_table['energy'].shape
+
+@pytest.mark.skipif('not HAS_EMCEE')
+def test_checkpoint(tmpdir):
+    checkpoint = str(tmpdir.join('checkpoint'))
+
+    sampler, pos = get_sampler(
+        data_table=data_table, p0=p0, labels=labels, model=cutoffexp,
+        prior=lnprior, nwalkers=10, nburn=0, threads=1)
+    rstate = sampler.random_state
+
+    sampler, _ = run_sampler(nrun=6, sampler=sampler, pos=pos)
+
+    # interrupted run
+    sampler2, _ = get_sampler(
+        data_table=data_table, p0=p0, labels=labels, model=cutoffexp,
+        prior=lnprior, nwalkers=10, nburn=0, threads=1)
+    sampler2.random_state = rstate
+    run_sampler(nrun=4, sampler=sampler2, pos=pos, checkpoint=checkpoint,
+                checkpoint_every=3)
+    assert len(tmpdir.join('checkpoint').listdir()) == 4
+
+    # resume run
+    sampler3, _ = run_sampler(
+        nrun=6, checkpoint=checkpoint, data_table=data_table, p0=p0,
+        labels=labels, model=cutoffexp, prior=lnprior, nwalkers=10, threads=1)
+
+    assert sampler3.chain.shape == (10, 6, 3)
+    assert sampler3.iterations == 6
+    assert len(sampler3.blobs) == 6
+    assert np.allclose(sampler3.chain, sampler.chain)
+    assert np.allclose(sampler3.lnprobability, sampler.lnprobability)
+    assert np.allclose(sampler3.acceptance_fraction, sampler.acceptance_fraction)
+
+    # completed run is not extended
+    sampler4, _ = run_sampler(
+        nrun=6, checkpoint=checkpoint, data_table=data_table, p0=p0,
+        labels=labels, model=cutoffexp, prior=lnprior, nwalkers=10, threads=1)
+    assert np.allclose(sampler4.chain, sampler.chain)
+
+@pytest.mark.skipif('not HAS_EMCEE')
+def test_chain_retention(tmpdir):
+    sampler, pos = get_sampler(
+        data_table=data_table, p0=p0, labels=labels, model=cutoffexp,
+        prior=lnprior, nwalkers=10, nburn=0, threads=1)
+    rstate = sampler.random_state
+
+    sampler, _ = run_sampler(nrun=10, sampler=sampler, pos=pos)
+    chain, blobs = sampler.chain, list(sampler.blobs)
+
+    for kwargs, steps in [(dict(thin=3), [0, 3, 6, 9]),
+                          (dict(keep_last=4), [6, 7, 8, 9]),
+                          (dict(keep_last=4, compact_blobs=False),
+                           [6, 7, 8, 9])]:
+        sampler2, _ = get_sampler(
+            data_table=data_table, p0=p0, labels=labels, model=cutoffexp,
+            prior=lnprior, nwalkers=10, nburn=0, threads=1)
+        sampler2.random_state = rstate
+        sampler2, _ = run_sampler(nrun=10, sampler=sampler2, pos=pos,
+                                  **kwargs)
+
+        assert sampler2.iterations == 10
+        assert np.allclose(sampler2.chain, chain[:, steps])
+        assert len(sampler2.blobs) == len(steps)
+        assert np.allclose(sampler2.blobs[-1][0][0].value, blobs[9][0][0].value)
+        assert np.allclose(sampler2.acceptance_fraction,
+                           sampler.acceptance_fraction)
+
+    # thinned checkpoint is resumed at the right step
+    checkpoint = str(tmpdir.join('checkpoint'))
+    sampler2, _ = get_sampler(
+        data_table=data_table, p0=p0, labels=labels, model=cutoffexp,
+        prior=lnprior, nwalkers=10, nburn=0, threads=1)
+    sampler2.random_state = rstate
+    run_sampler(nrun=7, sampler=sampler2, pos=pos, checkpoint=checkpoint,
+                checkpoint_every=1, thin=3)
+    sampler3, _ = run_sampler(
+        nrun=10, checkpoint=checkpoint, data_table=data_table, p0=p0,
+        labels=labels, model=cutoffexp, prior=lnprior, nwalkers=10, threads=1,
+        thin=3)
+    assert sampler3.iterations == 10
+    assert sampler3.chain.shape == (10, 4, 3)
+    assert np.allclose(sampler3.chain, chain[:, [0, 3, 6, 9]])
+
+    with pytest.raises(ValueError):
+        run_sampler(nrun=6, checkpoint=checkpoint, data_table=data_table,
+                    p0=p0, labels=labels, model=cutoffexp, prior=lnprior,
+                    nwalkers=12, threads=1)
+
+@pytest.mark.skipif('not HAS_EMCEE')
+def test_step_stats():
+    from ..core import step_stats_table
+
+    records = []
+    def callback(sampler, record):
+        records.append(record)
+
+    for vectorize, model, prior in [(False, cutoffexp, lnprior),
+            (True, cutoffexp_vectorized, lnprior_vectorized)]:
+        records = []
+        sampler, pos = run_sampler(
+            data_table=data_table, p0=p0, labels=labels, model=model,
+            prior=prior, nwalkers=10, nburn=2, nrun=5, threads=1,
+            vectorize=vectorize, callbacks=[callback])
+
+        # burn-in and run steps are passed to the callbacks
+        assert len(records) == 7
+        assert len(sampler.step_stats) == 5
+
+        table = step_stats_table(sampler)
+        assert len(table) == 5
+        assert np.all(table['n_evaluations'] >= 10)
+        assert np.all(table['acceptance_fraction'] <= 1)
+        assert table['median'].shape == (5, 3)
+        time_fractions = (table['time_fraction_prior'] + table['time_fraction_model']
+                          + table['time_fraction_likelihood'])
+        assert np.all((time_fractions > 0) & (time_fractions <= 1))
+
+def test_integrated_time():
+    from ..core import _integrated_time
+
+    # AR(1) process with autocorrelation time (1+phi)/(1-phi) = 19
+    np.random.seed(0)
+    phi = 0.9
+    x = np.zeros((32, 4000))
+    for i in range(1, x.shape[1]):
+        x[:, i] = phi * x[:, i - 1] + np.random.randn(x.shape[0])
+
+    tau = _integrated_time(x[:, :, np.newaxis])
+    assert np.allclose(tau, 19, rtol=0.1)
+
+@pytest.mark.skipif('not HAS_EMCEE')
+def test_autocorr_stop():
+    sampler, pos = run_sampler(
+        data_table=data_table, p0=p0, labels=labels,
+        model=cutoffexp_vectorized, prior=lnprior_vectorized, nwalkers=10,
+        nrun=1000, nburn=50, vectorize=True, callbacks=[],
+        autocorr_factor=5, autocorr_every=25, autocorr_tol=0.5)
+
+    nsteps = sampler.chain.shape[1]
+    assert nsteps < 1000
+    assert nsteps % 25 == 0
+    assert sampler.lnprobability.shape == (10, nsteps)
+    assert len(sampler.blobs) == nsteps
+    assert np.all(sampler.lnprobability < 0)
+
+    last_nsteps, tau = sampler.autocorr_history[-1]
+    assert last_nsteps == nsteps
+    assert np.all(nsteps > 5 * tau)
+
+@pytest.mark.skipif('not HAS_EMCEE')
+def test_worker_pool():
+    from ..core import _WorkerPool, step_stats_table
+
+    # a closure cannot be pickled, so it can only reach the workers at start-up
+    x0 = 1 * u.TeV
+    model = lambda pars, data: cutoffexp(pars, data) * (x0 / x0)
+
+    sampler, pos = run_sampler(
+        data_table=data_table, p0=p0, labels=labels, model=model,
+        prior=lnprior, nwalkers=10, nburn=2, nrun=5, threads=2)
+
+    assert isinstance(sampler.pool, _WorkerPool)
+    assert sampler.chain.shape == (10, 5, 3)
+    assert len(sampler.blobs) == 5
+
+    table = step_stats_table(sampler)
+    assert np.all(table['n_evaluations'] >= 10)
+    assert np.all(np.isfinite(table['time_fraction_model']))
+
+    sampler.pool.close()
+
+@pytest.mark.skipif('not HAS_EMCEE')
+def test_socket_pool():
+    from multiprocessing import Process
+    from ..core import SocketPool, run_worker, step_stats_table
+
+    pool = SocketPool(('localhost', 0), nworkers=2, authkey=b'naima-test')
+    workers = [Process(target=run_worker, args=(pool.address, b'naima-test'))
+               for i in range(2)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        sampler, pos = run_sampler(
+            data_table=data_table, p0=p0, labels=labels, model=cutoffexp,
+            prior=lnprior, nwalkers=10, nburn=2, nrun=5, pool=pool)
+    finally:
+        pool.close()
+        for worker in workers:
+            worker.join(10)
+
+    assert sampler.chain.shape == (10, 5, 3)
+    assert len(sampler.blobs) == 5
+    assert np.all(np.isfinite(step_stats_table(sampler)['time_fraction_model']))
+    assert all(worker.exitcode == 0 for worker in workers)
+
+    # pools evaluate walkers one by one
+    with pytest.raises(ValueError):
+        get_sampler(data_table=data_table, p0=p0, labels=labels,
+                    model=cutoffexp_vectorized, prior=lnprior_vectorized,
+                    nwalkers=10, nburn=0, vectorize=True, pool=pool)
+
+@pytest.mark.skipif('not HAS_EMCEE')
+def test_priors():
+    from ..core import Prior
+
+    def gaussian(x, mean, sigma):
+        return np.exp(-(x - mean)**2 / (2 * sigma**2)) / (sigma * np.sqrt(2 * np.pi))
+
+    assert np.allclose(normal_prior(1.2, 1.4, 0.5), np.log(gaussian(1.2, 1.4, 0.5)))
+    assert np.allclose(normal_prior(np.array([1., 2.]), 1.4, 0.5),
+                       np.log(gaussian(np.array([1., 2.]), 1.4, 0.5)))
+
+    assert uniform_prior(1., 0., 2.) == 0.
+    assert uniform_prior(3., 0., 2.) == -np.inf
+    assert np.all(uniform_prior(np.array([-1., 1., 3.]), 0., 2.) ==
+                  np.array([-np.inf, 0., -np.inf]))
+
+    prior = Prior(labels)
+    prior.uniform('norm', 0., np.inf).normal(1, 1.4, 0.5).uniform('cutoff', 0.)
+
+    pars = emcee.utils.sample_ball(p0, 0.05 * p0, 10)
+    pars[2, 0] = -1.
+    pars[5, 2] = -1.
+
+    lnp = prior(pars)
+    assert lnp.shape == (10,)
+    for par, lnp_par in zip(pars, lnp):
+        assert np.allclose(prior(par), lnprior(par))
+        assert np.allclose(lnp_par, lnprior(par))
+    assert np.all(np.isinf(lnp[[2, 5]]))
+
+    with pytest.raises(ValueError):
+        prior.uniform('alpha', 0, 1)
+
+@pytest.mark.skipif('not HAS_EMCEE')
+def test_prior_sampler():
+    from ..core import Prior
+
+    prior = Prior(labels)
+    prior.uniform('norm', 0., np.inf).normal('index', 1.4, 0.5).uniform('cutoff', 0.)
+
+    for vectorize, model in [(False, cutoffexp), (True, cutoffexp_vectorized)]:
+        sampler, pos = run_sampler(
+            data_table=data_table, p0=p0, labels=labels, model=model,
+            prior=prior, nwalkers=10, nburn=2, nrun=5, threads=1,
+            vectorize=vectorize)
+        assert sampler.chain.shape == (10, 5, 3)
+
+def test_likelihood_data():
+    from ..core import _LikelihoodData, lnprob
+    from ..utils import validate_data_table
+
+    for table in [data_table, data_table2]:
+        data = validate_data_table(table)
+        # flag two points as upper limits
+        data['ul'][[2, 5]] = True
+        like = _LikelihoodData(data)
+
+        pars = emcee.utils.sample_ball(p0, 0.1 * p0, 10)
+        models = [cutoffexp(par, data) for par in pars]
+        models = np.array([m.value for m in models]) * models[0].unit
+
+        for model, lnp in zip(models, like(models)):
+            # reference log-likelihood with Quantity arithmetic
+            notul = ~data['ul']
+            diff = model[notul] - data['flux'][notul]
+            err = np.where(diff.value > 0, data['dflux'][1][notul].value,
+                           data['dflux'][0][notul].value) * data['dflux'].unit
+            ref = - np.sum((diff ** 2 / (2 * err ** 2)).decompose().value)
+            nviol = np.sum(model[data['ul']] > data['flux'][data['ul']])
+            ref += nviol * np.log(1. - data['cl'])
+            assert np.allclose(lnp, ref)
+            assert np.allclose(like(model.to('1/(m2 s GeV)')), ref)
+
+        lnp, blob = lnprob(pars[0], data, cutoffexp, lnprior, likelihood=like)
+        assert np.allclose(lnp, like(models[0]) + lnprior(pars[0]))
+
+    sampler, pos = get_sampler(data_table=data_table, p0=p0, labels=labels,
+                               model=cutoffexp, prior=lnprior, nwalkers=10,
+                               nburn=0, threads=1)
+    assert isinstance(sampler.likelihood, _LikelihoodData)
+
+@pytest.mark.skipif('not HAS_EMCEE')
+def test_prefit():
+    from ..core import lnprob
+    from ..utils import validate_data_table
+
+    data = validate_data_table(data_table)
+    lnp0 = lnprob(p0, data, cutoffexp, lnprior)[0]
+
+    for vectorize, model, prior in [(False, cutoffexp, lnprior),
+                                    (True, cutoffexp_vectorized,
+                                     lnprior_vectorized)]:
+        sampler, pos = get_sampler(data_table=data_table, p0=p0,
+                                   labels=labels, model=model, prior=prior,
+                                   nwalkers=20, nburn=0, threads=1,
+                                   vectorize=vectorize, prefit=True)
+        result = sampler.map_result
+        assert result.lnprob > lnp0
+        assert np.allclose(result.lnprob,
+                           lnprob(result.x, data, cutoffexp, lnprior)[0])
+
+        # walkers are drawn from the covariance around the mode
+        assert result.cov.shape == (3, 3)
+        assert np.all(np.diag(result.cov) > 0)
+        assert pos.shape == (20, 3)
+        assert np.all(np.isfinite([lnprior(p) for p in pos]))
+        assert np.all(np.abs(np.median(pos, axis=0) - result.x)
+                      < 3 * np.sqrt(np.diag(result.cov)))
+
+@pytest.mark.skipif('not HAS_EMCEE')
+def test_run_batch(tmpdir):
+    from ..core import run_batch
+
+    outdir = str(tmpdir.join('batch'))
+    bad_table = data_table.copy()
+    bad_table.remove_column('flux')
+    tables = {'crab': data_table, 'crab2': data_table2, 'bad': bad_table}
+
+    kwargs = dict(p0=p0, labels=labels, model=cutoffexp, prior=lnprior,
+                  nwalkers=10, nburn=2, nrun=5, processes=2, retries=1)
+    results = run_batch(tables, outdir, **kwargs)
+
+    assert list(results['name']) == ['bad', 'crab', 'crab2']
+    assert list(results['status']) == ['failed', 'done', 'done']
+    assert results['attempts'][0] == 2
+    assert tmpdir.join('batch', 'bad.failed').check()
+    # checkpoints of finished fits are removed
+    assert not tmpdir.join('batch', 'crab_checkpoint').check()
+    assert tmpdir.join('batch', 'bad_checkpoint').check()
+
+    fit = np.load(str(tmpdir.join('batch', 'crab.npz')))
+    assert fit['chain'].shape == (10, 5, 3)
+    assert list(fit['labels']) == labels
+
+    # finished sources are not fit again
+    results = run_batch(tables, outdir, **kwargs)
+    assert list(results['status']) == ['failed', 'skipped', 'skipped']
@@ -278,6 +278,133 @@ def test_pion_decay_kelner(particle_dists):
 
     assert_allclose(lpp.value, lum_ref[0])
 
+def test_particle_grid_cache(particle_dists):
+    """
+    test memoization and invalidation of particle energy grids
+    """
+    from ..models import Synchrotron, PionDecay
+
+    ECPL,PL,BPL = particle_dists
+
+    sy = Synchrotron(ECPL, **electron_properties)
+    gam, nelec = sy._gam, sy._nelec
+    assert sy._gam is gam
+    assert sy._nelec is nelec
+
+    # change in particle distribution parameters
+    ECPL.alpha = 2.5
+    assert sy._gam is gam
+    assert not np.all(sy._nelec == nelec)
+    ECPL.e_cutoff = 2 * e_cutoff.to('GeV')
+    assert_allclose(sy._nelec,
+            ECPL(sy._gam * m_e * c**2).to(pdist_unit).value)
+
+    # change in grid definition
+    sy.nEed = 50
+    assert len(sy._gam) < len(gam)
+    assert len(sy._nelec) == len(sy._gam)
+
+    # distributions without param_names are never cached
+    sy.particle_distribution = lambda E: PL(E)
+    assert_allclose(sy._nelec,
+            PL(sy._gam * m_e * c**2).to(pdist_unit).value)
+
+    PL.amplitude = 1/u.TeV
+    pp = PionDecay(PL, **proton_properties)
+    J = pp._J
+    assert pp._J is J
+    pp.Epmax = 10 * u.PeV
+    assert len(pp._J) > len(J)
+
+    # all parameters of the distribution invalidate the cache
+    from ..models import ExponentialCutoffBrokenPowerLaw
+    ECBPL = ExponentialCutoffBrokenPowerLaw(1*pdist_unit, e_0, e_break,
+                                            alpha_1, alpha_2, e_cutoff)
+    sy = Synchrotron(ECBPL, **electron_properties)
+    nelec = sy._nelec
+    for name, value in [('e_cutoff', 3 * e_cutoff), ('beta', 2.)]:
+        setattr(ECBPL, name, value)
+        assert not np.all(sy._nelec == nelec)
+        assert_allclose(sy._nelec,
+                ECBPL(sy._gam * m_e * c**2).to(pdist_unit).value)
+        nelec = sy._nelec
+
+    # the class of the distribution is part of its fingerprint
+    from ..models import PowerLaw
+    from ..radiative import _pdist_fingerprint
+
+    class OtherPowerLaw(PowerLaw):
+        pass
+
+    fingerprint = _pdist_fingerprint(PL)
+    PL.__class__ = OtherPowerLaw
+    assert _pdist_fingerprint(PL) != fingerprint
+
+@pytest.mark.skipif('not HAS_SCIPY')
+def test_ic_kernel_cache(particle_dists):
+    """
+    test reuse of IC kernels for changing particle distributions
+    """
+    from ..models import InverseCompton
+    from ..radiative import _kernel_cache, _KernelCache
+
+    ECPL,PL,BPL = particle_dists
+
+    _kernel_cache.clear()
+    ic = InverseCompton(ECPL, seed_photon_fields=['CMB', 'FIR'],
+                        **electron_properties)
+    ic_nocache = InverseCompton(ECPL, seed_photon_fields=['CMB', 'FIR'],
+                                cache_kernels=False, **electron_properties)
+
+    spec = ic.spectrum(energy)
+    assert len(_kernel_cache) == 2
+    assert_allclose(spec, ic_nocache.spectrum(energy))
+
+    ECPL.amplitude *= 3
+    spec2 = ic.spectrum(energy)
+    assert len(_kernel_cache) == 2
+    assert_allclose(spec2, 3 * spec)
+
+    ECPL.alpha = 1.5
+    assert_allclose(ic.spectrum(energy), ic_nocache.spectrum(energy))
+
+    # LRU eviction
+    cache = _KernelCache(maxsize=2)
+    cache.get('a', lambda: 1)
+    cache.get('b', lambda: 2)
+    cache.get('a', lambda: 0)
+    cache.get('c', lambda: 3)
+    assert 'a' in cache and 'c' in cache
+    assert 'b' not in cache
+
+@pytest.mark.skipif('not HAS_SCIPY')
+def test_sy_kernel_cache(particle_dists):
+    """
+    test reuse of synchrotron kernels for changing particle distributions
+    """
+    from ..models import Synchrotron
+    from ..radiative import _kernel_cache
+
+    ECPL,PL,BPL = particle_dists
+
+    _kernel_cache.clear()
+    sy = Synchrotron(ECPL, B=10*u.uG, **electron_properties)
+    sy_nocache = Synchrotron(ECPL, B=10*u.uG, cache_kernels=False,
+                             **electron_properties)
+
+    spec = sy.spectrum(energy)
+    assert len(_kernel_cache) == 1
+    assert_allclose(spec, sy_nocache.spectrum(energy))
+
+    ECPL.e_cutoff = 3 * e_cutoff
+    assert_allclose(sy.spectrum(energy), sy_nocache.spectrum(energy))
+    assert len(_kernel_cache) == 1
+
+    # a new magnetic field requires a new kernel
+    sy.B = sy_nocache.B = 100*u.uG
+    assert_allclose(sy.spectrum(energy), sy_nocache.spectrum(energy))
+    assert len(_kernel_cache) == 2
+
 def test_inputs():
     """ test input validation with LogParabola and ExponentialCutoffBrokenPowerLaw
     """
@@ -297,3 +424,306 @@ def test_inputs():
         data = {'flux':[1,2,4]}
         LP(data)
 
+
+@pytest.mark.skipif('not HAS_SCIPY')
+def test_sy_Gtilde_LUT(particle_dists):
+    """
+    test accuracy of tabulated synchrotron function
+    """
+    from ..models import Synchrotron
+
+    ECPL,PL,BPL = particle_dists
+
+    x = np.logspace(-15, np.log10(700), 100000)
+    sy = Synchrotron(ECPL, **electron_properties)
+    sy.spectrum(energy)
+    assert_allclose(Synchrotron._Gtilde_LUT(x), Synchrotron._Gtilde(x),
+                    rtol=2e-7)
+    assert np.all(Synchrotron._Gtilde_LUT(np.array([1e4, 1e6])) == 0)
+
+    sy_analytic = Synchrotron(ECPL, useLUT=False, **electron_properties)
+    assert_allclose(sy.spectrum(energy), sy_analytic.spectrum(energy),
+                    rtol=1e-6)
+
+@pytest.mark.skipif('not HAS_SCIPY')
+def test_pion_decay_LUT_cache(particle_dists):
+    """
+    test that PionDecay lookup tables are only loaded once
+    """
+    from ..models import PionDecay
+    from ..radiative import _LUTs
+
+    ECPL,PL,BPL = particle_dists
+
+    energy = np.logspace(-1, 2, 10) * u.TeV
+    pp1 = PionDecay(ECPL, **proton_properties)
+    pp1.spectrum(energy)
+    pp2 = PionDecay(PL, **proton_properties)
+    pp2.spectrum(energy)
+
+    assert pp1.diffsigma is pp2.diffsigma
+    assert 'PionDecayKafexhiu14_LUT_NucEnh_Pythia8.npz' in _LUTs
+
+    # missing tables revert to the analytic cross section
+    import warnings
+    pp3 = PionDecay(ECPL, hiEmodel='QGSJET', **proton_properties)
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        pp3.spectrum(energy)
+    w = [x for x in w if 'not found' in str(x.message)]
+    assert len(w) == 1
+    assert not pp3.useLUT
+
+@pytest.mark.skipif('not HAS_SCIPY')
+def test_pion_decay_vectorized(particle_dists):
+    """
+    test vectorized PionDecay cross section against per-energy evaluation
+    """
+    from ..models import PionDecay
+    from ..radiative import _kernel_cache
+
+    ECPL,PL,BPL = particle_dists
+    ECPL.amplitude = 1 / u.TeV
+
+    # unsorted photon energies
+    energy = np.logspace(-3, 3, 30)[::-1] * u.TeV
+    for useLUT, hiEmodel in [(True, 'Pythia8'), (False, 'Geant4')]:
+        pp = PionDecay(ECPL, useLUT=useLUT, hiEmodel=hiEmodel,
+                       **proton_properties)
+        spec = pp.spectrum(energy)
+        Eg = energy.to('GeV').value
+        diffsigma = np.array([pp.diffsigma(pp._Ep, eg) for eg in Eg]).T
+        assert_allclose(pp.diffsigma(pp._Ep, Eg), diffsigma)
+
+        specloop = [trapz_loglog(pp._J * ds, pp._Ep) for ds in diffsigma.T]
+        specloop = (specloop * u.Unit('cm2/GeV') * pp.nh * c).to('1/(s eV)')
+        assert_allclose(spec, specloop)
+
+    # kernel is reused when only the particle distribution changes
+    _kernel_cache.clear()
+    spec = pp.spectrum(energy)
+    ECPL.amplitude = 2 / u.TeV
+    assert_allclose(pp.spectrum(energy), 2 * spec)
+    assert len(_kernel_cache) == 1
+
+@pytest.mark.skipif('not HAS_SCIPY')
+def test_pion_decay_kelner_grid(particle_dists):
+    """
+    test fixed-grid integration of PionDecayKelner06 against quad
+    """
+    from ..radiative import PionDecayKelner06 as PionDecay
+
+    ECPL,PL,BPL = particle_dists
+
+    for pdist in [ECPL,PL,BPL]:
+        pdist.amplitude = 1*(1/u.TeV)
+
+    energy = np.logspace(-3, 2, 15) * u.TeV
+    for pdist in particle_dists:
+        pp = PionDecay(pdist, **proton_properties)
+        spec_quad = pp.spectrum(energy)
+        pp.integrator = 'grid'
+        spec_grid = pp.spectrum(energy)
+        assert_allclose(spec_grid, spec_quad, rtol=1e-3)
+        assert np.all(pp.specpp_err < 1e-3 * spec_grid)
+
+    with pytest.raises(ValueError):
+        pp.integrator = 'fixed_quad'
+        pp.spectrum(energy)
+
+@pytest.mark.skipif('not HAS_SCIPY')
+def test_bremsstrahlung_kernel_cache(particle_dists):
+    """
+    test reuse of bremsstrahlung cross sections
+    """
+    from ..models import Bremsstrahlung
+    from ..radiative import _kernel_cache
+
+    ECPL,PL,BPL = particle_dists
+
+    energy2 = np.logspace(5,14,50) * u.eV
+
+    _kernel_cache.clear()
+    brems = Bremsstrahlung(ECPL, Eemin = m_e*c**2)
+    brems_nocache = Bremsstrahlung(ECPL, Eemin = m_e*c**2, cache_kernels=False)
+    spec = brems.spectrum(energy2)
+    assert len(_kernel_cache) == 2
+    assert_allclose(spec, brems_nocache.spectrum(energy2))
+
+    ECPL.alpha = 2.5
+    assert_allclose(brems.spectrum(energy2), brems_nocache.spectrum(energy2))
+    assert len(_kernel_cache) == 2
+
+    # pure electron-electron and electron-proton bremsstrahlung
+    brems_ee = Bremsstrahlung(ECPL, Eemin = m_e*c**2, weight_ep=0)
+    brems_ep = Bremsstrahlung(ECPL, Eemin = m_e*c**2, weight_ee=0)
+    assert_allclose(brems_ee.spectrum(energy2) + brems_ep.spectrum(energy2),
+                    brems.spectrum(energy2))
+
+@pytest.mark.skipif('not HAS_SCIPY')
+def test_spectrum_batch(particle_dists):
+    """
+    test batched evaluation of spectra for several particle distributions
+    """
+    from ..models import (Synchrotron, InverseCompton, Bremsstrahlung,
+                          PionDecay, ExponentialCutoffPowerLaw)
+    from ..radiative import PionDecayKelner06
+
+    pdists = [ExponentialCutoffPowerLaw(1e36/u.eV, 1*u.TeV, alpha, e_cutoff*u.TeV)
+              for alpha, e_cutoff in [(2.0, 10.), (2.3, 50.), (1.8, 100.)]]
+
+    models = [(Synchrotron(pdists[0], B=10*u.uG), np.logspace(-6,4,30)*u.eV),
+              (InverseCompton(pdists[0], seed_photon_fields=['CMB','FIR']),
+                  np.logspace(6,14,30)*u.eV),
+              (Bremsstrahlung(pdists[0], n0=1/u.cm**3), np.logspace(6,14,30)*u.eV),
+              (PionDecay(pdists[0]), np.logspace(8,14,30)*u.eV),
+              (PionDecayKelner06(pdists[0]), np.logspace(8,14,30)*u.eV)]
+
+    for model, energy2 in models:
+        specs = model.spectrum_batch(energy2, pdists)
+        assert specs.shape == (len(pdists), energy2.size)
+        for pdist, spec in zip(pdists, specs):
+            model.particle_distribution = pdist
+            ref = model.spectrum(energy2)
+            # same integration as spectrum, equal up to rounding errors
+            assert_allclose(spec.to(ref.unit).value, ref.value, rtol=1e-8)
+
+@pytest.mark.skipif('not HAS_SCIPY')
+def test_bind(particle_dists):
+    """
+    test radiative models and functions bound to a fixed energy array
+    """
+    from ..models import InverseCompton, PionDecay, ExponentialCutoffBrokenPowerLaw
+
+    ECPL,PL,BPL = particle_dists
+    ECBPL = ExponentialCutoffBrokenPowerLaw(1/u.eV, 1*u.TeV, 10*u.TeV, 2., 3.,
+                                            50*u.TeV)
+
+    energy2 = np.logspace(9,13,20) * u.eV
+
+    for pdist in [ECPL, PL, BPL, ECBPL]:
+        bound_pdist = pdist.bind(energy2)
+        assert_allclose(bound_pdist().value, pdist(energy2).value)
+
+    # changes to the parameters are taken into account
+    ECBPL.e_cutoff = 20 * u.TeV
+    assert_allclose(bound_pdist().value, ECBPL(energy2).value)
+
+    for model in [InverseCompton(ECPL), PionDecay(ECPL)]:
+        for distance in [0, 2*u.kpc]:
+            bound = model.bind(energy2, distance)
+            sed = model.sed(energy2, distance)
+            assert bound.sed().unit == sed.unit
+            assert_allclose(bound.sed().value, sed.value)
+            assert_allclose(bound.flux().value, model.flux(energy2, distance).value)
+            assert_allclose(bound.spectrum().value, model.spectrum(energy2).value)
+
+        ECPL.alpha += 0.5
+        assert_allclose(bound.sed().value, model.sed(energy2, distance).value)
+        ECPL.alpha -= 0.5
+
+    # unit-free energies and kernel cache keys are computed once at bind time
+    from ..models import Synchrotron, Bremsstrahlung
+    for model in [Synchrotron(ECPL), InverseCompton(ECPL), PionDecay(ECPL),
+                  Bremsstrahlung(ECPL)]:
+        bound = model.bind(energy2)
+        spec = bound.spectrum()
+        assert_allclose(spec.to('1/(s eV)').value,
+                        model.spectrum(energy2).to('1/(s eV)').value)
+        keys = dict(bound._energies._keys)
+        assert len(keys) == 1
+        assert_allclose(bound.spectrum().value, spec.value)
+        for unit, key in keys.items():
+            assert bound._energies._keys[unit] is key
+
+@pytest.mark.skipif('not HAS_SCIPY')
+def test_chunked_kernels(particle_dists):
+    """
+    test evaluation of kernels in blocks of photon energies
+    """
+    from ..radiative import (Synchrotron, InverseCompton, Bremsstrahlung,
+                             _kernel_cache)
+
+    ECPL,PL,BPL = particle_dists
+
+    for cls, kwargs in [(Synchrotron, {'B': 10*u.uG}),
+                        (InverseCompton, {'seed_photon_fields': ['CMB', 'FIR']}),
+                        (Bremsstrahlung, {})]:
+        model = cls(ECPL, **kwargs)
+        model_chunked = cls(ECPL, max_kernel_memory=1e6, **kwargs)
+        nblocks = len(model_chunked._photon_slices(energy.size))
+        assert nblocks > 1
+
+        _kernel_cache.clear()
+        assert_allclose(model_chunked.spectrum(energy), model.spectrum(energy))
+        # only the kernels of the unchunked model are cached
+        ncached = len(_kernel_cache)
+        assert_allclose(model_chunked.spectrum(energy), model.spectrum(energy))
+        assert len(_kernel_cache) == ncached
+
+        # batched spectra are computed in the same blocks
+        pdists = [ECPL, PL]
+        assert_allclose(model_chunked.spectrum_batch(energy, pdists),
+                        model.spectrum_batch(energy, pdists))
+        ncached = len(_kernel_cache)
+        model_chunked.spectrum_batch(energy, pdists)
+        assert len(_kernel_cache) == ncached
+
+        # scalar photon energy
+        assert_allclose(model_chunked.spectrum(1*u.TeV),
+                        model.spectrum(1*u.TeV))
+
+@pytest.mark.skipif('not HAS_SCIPY')
+def test_trimmed_electron_grid(particle_dists):
+    """
+    test restriction of the electron grid to the populated range
+    """
+    from ..radiative import Synchrotron, InverseCompton, Bremsstrahlung
+
+    ECPL,PL,BPL = particle_dists
+
+    for cls, kwargs, energy2 in [
+            (Synchrotron, {'B': 10*u.uG}, np.logspace(-6, 6, 50)*u.eV),
+            (InverseCompton, {}, np.logspace(6, 14, 50)*u.eV),
+            (Bremsstrahlung, {}, np.logspace(8, 14, 50)*u.eV)]:
+        model = cls(ECPL, **kwargs)
+        model_trim = cls(ECPL, grid_tol=1e-2, **kwargs)
+        spec = model.spectrum(energy2)
+        spec_trim = model_trim.spectrum(energy2)
+        assert model.grid_error == 0.
+
+        assert model_trim._gam.size < model._gam.size
+        assert model_trim._nelec.shape == model_trim._gam.shape
+        assert model_trim._gam[0] == model._gam[0]
+        assert 0 < model_trim.grid_error <= 1e-2
+        assert_allclose(model_trim.We, model.We)
+
+        # the error at the highest photon energy is the discarded fraction,
+        # and it bounds the error at lower energies
+        rel_error = 1 - (spec_trim / spec).decompose().value
+        assert_allclose(rel_error[-1], model_trim.grid_error, rtol=1e-6)
+        assert np.all(rel_error <= model_trim.grid_error * (1 + 1e-6))
+
+        # the grid follows the photon energies and the particle distribution
+        ngam = model_trim._gam.size
+        model_trim.spectrum(energy2[:25])
+        assert model_trim._gam.size < ngam
+        ECPL.e_cutoff = 10 * e_cutoff
+        model_trim.spectrum(energy2)
+        assert model_trim._gam.size > ngam
+        ECPL.e_cutoff = e_cutoff
+
+        # batched spectra use the full grid, also for the power law
+        pdists = [ECPL, PL]
+        assert_allclose(model_trim.spectrum_batch(energy2, pdists),
+                        model.spectrum_batch(energy2, pdists))
+
+    # distributions without parameters are not trimmed
+    import warnings
+    sy = Synchrotron(lambda E: ECPL(E), grid_tol=1e-2)
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        sy.spectrum(energy)
+    w = [x for x in w if 'can only be trimmed' in str(x.message)]
+    assert len(w) == 1
+    assert sy._gam.size == Synchrotron(ECPL)._gam.size
@@ -168,3 +168,66 @@ def test_diagnostic_plots(sampler):
         'test_function_3', sampler, sed=[True, True, False, ])
     generate_diagnostic_plots('test_function_4', sampler, sed=False)
     generate_diagnostic_plots('test_function_5', sampler, sed=True, pdf=True)
+
+
+@pytest.mark.skipif('not HAS_EMCEE')
+def test_blob_store(sampler):
+    from ..core import _BlobStore
+    from ..plot import _process_blob
+
+    store = sampler.blobs
+    assert isinstance(store, _BlobStore)
+    assert len(store) == 2
+    assert ([field.kind for field in store.fields] ==
+            ['array', 'pair', 'pair', 'pair', 'array', 'object', 'array',
+             'object', 'scalar', 'scalar'])
+
+    compact = {}
+    for idx in [0, 1, 2, 3, 4, 8, 9]:
+        for last_step in [True, False]:
+            compact[idx, last_step] = _process_blob(sampler, idx, last_step)
+
+    # compare with the nested list of blobs
+    sampler._blobs = list(store)
+    assert len(sampler.blobs[-1]) == 10
+    for (idx, last_step), (modelx, model) in compact.items():
+        modelx_list, model_list = _process_blob(sampler, idx, last_step)
+        if modelx is None:
+            assert modelx_list is None
+        else:
+            assert np.all(modelx == modelx_list)
+        assert model.unit == model_list.unit
+        assert np.allclose(model.value, model_list.value)
+
+    # blobs that change format are kept as objects
+    store = _BlobStore(2, capacity=1)
+    ene = np.logspace(0, 1, 5) * u.TeV
+    store.append([(1 * u.erg, (ene, ene.value * u.s)), None])
+    store.append([(2 * u.erg, (ene, ene.value * u.s)),
+                  (3 * u.erg, (2 * ene, ene.value * u.s))])
+    assert [field.kind for field in store.fields] == ['scalar', 'object']
+    assert store[0][1] is None
+    assert store[-1][1][0] == 3 * u.erg
+    assert np.all(store[-1][1][1][0] == 2 * ene)
+
+    # steps where all walkers are outside of the prior
+    store = _BlobStore(2, capacity=1)
+    store.append([None, None])
+    store.append([None, None])
+    store.append([None, (1 * u.erg, ['a'])])
+    assert len(store) == 3
+    assert store[0] == [None, None]
+    assert store[-1][0] is None
+    assert store[-1][1][0] == 1 * u.erg
+    assert store[-1][1][1] == ['a']
+    assert [field.kind for field in store.fields] == ['scalar', 'object']
+
+    # only the last steps are kept
+    store = _BlobStore(2, capacity=10, maxlen=3)
+    for i in range(10):
+        store.append([(i * u.erg, ['a'] * i), (i * u.erg, ['b'] * i)])
+    assert len(store) == 3
+    assert len(store.missing) == 6
+    assert np.all(u.Quantity([step[0][0] for step in store]) ==
+                  [7, 8, 9] * u.erg)
+    assert store[0][1][1] == ['b'] * 7
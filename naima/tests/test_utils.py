@@ -85,3 +85,42 @@ def test_build_data_table():
     with pytest.raises(TypeError):
         table = build_data_table(ene.value*u.Unit('erg/(cm2 s)'), flux, flux_error=flux_error_hi)
 
+
+def test_trapz_loglog_plan():
+    from ..utils import trapz_loglog, TrapzLogLogPlan
+
+    x = np.logspace(0, 3, 50)
+    # power laws with index -1, zeros, negative ordinates (e.g., from spline
+    # interpolation of cross sections) and repeated abscissa
+    y = np.vstack([x ** -2.5, 1 / x, np.exp(-x / 100.), np.zeros_like(x),
+                   np.sin(5 * np.log(x)), -x ** -2])
+    y[2, 10] = 0.
+    x[20] = x[21]
+
+    plan = TrapzLogLogPlan(x * u.TeV)
+    for axis, yy in [(-1, y), (0, y.T)]:
+        ref = trapz_loglog(yy * u.Unit('1/TeV'), x * u.TeV, axis=axis)
+        for i in range(2):
+            # work arrays are reused between calls
+            res = plan(yy * u.Unit('1/TeV'), axis=axis)
+            assert res.unit.is_equivalent(u.dimensionless_unscaled)
+            assert np.all(np.isfinite(res))
+            assert np.allclose(res.value, ref.value, rtol=1e-10)
+
+        # with units, a Quantity view of out is returned
+        ref = trapz_loglog(yy, x, axis=axis, intervals=True)
+        out = np.empty_like(ref)
+        res = plan(yy, axis=axis, intervals=True, out=out)
+        assert res.unit == u.TeV
+        assert np.may_share_memory(res, out)
+        assert np.allclose(out, ref, rtol=1e-10)
+
+        # without units, out itself is returned
+        ref = trapz_loglog(yy, x, axis=axis)
+        out = np.empty_like(ref)
+        res = TrapzLogLogPlan(x)(yy, axis=axis, out=out)
+        assert res is out
+        assert np.allclose(out, ref, rtol=1e-10)
+
+    with pytest.raises(ValueError):
+        plan(y[:, :-1])
@@ -226,6 +226,150 @@ def trapz_loglog(y, x, axis=-1, intervals=False):
     return ret
 
 
+class TrapzLogLogPlan(object):
+    """
+    Precomputed integration plan for `trapz_loglog` on a fixed abscissa.
+
+    The terms of the trapezoidal rule in loglog space that only depend on the
+    abscissa ``x`` are computed once, and the work arrays for the ordinate are
+    kept between calls with the same ordinate shape, so that repeated
+    integrals on the same grid (e.g., the particle energy grid of a radiative
+    model) avoid most of the temporary arrays allocated by `trapz_loglog`.
+
+    Parameters
+    ----------
+    x : array_like
+        One-dimensional independent variable to integrate over.
+    """
+
+    def __init__(self, x):
+        try:
+            self.x_unit = x.unit
+            x = x.value
+        except AttributeError:
+            self.x_unit = None
+
+        x = np.array(x, dtype=float)
+        if x.ndim != 1:
+            raise ValueError('TrapzLogLogPlan requires a one-dimensional x')
+
+        self.x = x
+        self._x1 = x[:-1]
+        self._x2 = x[1:]
+        with np.errstate(all='ignore'):
+            self._lnxr = np.log(self._x2 / self._x1)
+            self._inv_lnxr = 1. / self._lnxr
+        self._xzero = self._x1 == self._x2
+
+        self._buffers = None
+
+    def _work_arrays(self, shape):
+        """Work arrays for intervals of shape ``shape``, reused between calls.
+        """
+        if self._buffers is None or self._buffers[0] != shape:
+            self._buffers = (shape, np.empty(shape), np.empty(shape),
+                             np.empty(shape), np.empty(shape, dtype=bool),
+                             np.empty(shape, dtype=bool))
+        return self._buffers[1:]
+
+    def __call__(self, y, axis=-1, intervals=False, out=None):
+        """
+        Integrate ``y`` along the given axis.
+
+        Parameters
+        ----------
+        y : array_like
+            Input array to integrate. Its length along ``axis`` must match the
+            length of ``x``.
+        axis : int, optional
+            Specify the axis.
+        intervals : bool, optional
+            Whether to return the integral in each interval instead of the
+            total.
+        out : `~numpy.ndarray`, optional
+            Array in which to store the result (without units). It must have
+            the shape of the result.
+
+        Returns
+        -------
+        trapz : float or array
+            Definite integral as approximated by trapezoidal rule in loglog
+            space. If ``out`` is given, it is returned when neither ``x`` nor
+            ``y`` have units, and a `~astropy.units.Quantity` view of it
+            otherwise.
+        """
+        try:
+            y_unit = y.unit
+            y = y.value
+        except AttributeError:
+            y_unit = None
+
+        y = np.asanyarray(y)
+        axis = axis % y.ndim
+        if y.shape[axis] != len(self.x):
+            raise ValueError('The length of y along axis {0} ({1}) does not '
+                             'match that of x ({2})'.format(
+                                 axis, y.shape[axis], len(self.x)))
+
+        slice1 = [slice(None)] * y.ndim
+        slice2 = [slice(None)] * y.ndim
+        slice1[axis] = slice(None, -1)
+        slice2[axis] = slice(1, None)
+        y1 = y[tuple(slice1)]
+        y2 = y[tuple(slice2)]
+
+        shape = [1] * y.ndim
+        shape[axis] = len(self.x) - 1
+        x1 = self._x1.reshape(shape)
+        x2 = self._x2.reshape(shape)
+
+        bp1, trapzs, x1y1, tozero, mask = self._work_arrays(y1.shape)
+
+        with np.errstate(all='ignore'):
+            # Power law index plus one in each integration bin
+            np.divide(y2, y1, out=bp1)
+            np.log(bp1, out=bp1)
+            np.multiply(bp1, self._inv_lnxr.reshape(shape), out=bp1)
+            bp1 += 1.
+
+            # The power law integral simplifies to (x2 y2 - x1 y1) / (b + 1)
+            np.multiply(x1, y1, out=x1y1)
+            np.multiply(x2, y2, out=trapzs)
+            trapzs -= x1y1
+            trapzs /= bp1
+
+            # if local powerlaw index is -1 or undefined (ordinates of
+            # different sign), use \int 1/x = log(x), as trapz_loglog does
+            np.abs(bp1, out=bp1)
+            np.greater(bp1, 1e-10, out=mask)
+            np.logical_not(mask, out=mask)
+            if mask.any():
+                x1y1 *= self._lnxr.reshape(shape)
+                np.copyto(trapzs, x1y1, where=mask)
+
+        np.equal(y1, 0., out=tozero)
+        np.equal(y2, 0., out=mask)
+        tozero |= mask
+        tozero |= self._xzero.reshape(shape)
+        trapzs[tozero] = 0.
+
+        if intervals:
+            if out is None:
+                ret = trapzs.copy()
+            else:
+                np.copyto(out, trapzs)
+                ret = out
+        else:
+            ret = np.add.reduce(trapzs, axis, out=out)
+
+        if self.x_unit is None and y_unit is None:
+            return ret
+
+        x_unit = u.dimensionless_unscaled if self.x_unit is None else self.x_unit
+        y_unit = u.dimensionless_unscaled if y_unit is None else y_unit
+        return u.Quantity(ret, x_unit * y_unit, copy=False)
+
+
 def generate_energy_edges(ene):
     """Generate energy bin edges from given energy array.
 